@@ -7,11 +7,26 @@
 
 import copy
 from datetime import date, datetime
+import hashlib
 import json
 import logging
 import os
 import sqlite3
 import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    # py2
+    import Queue as queue
+
+try:
+    unichr
+except NameError:
+    # Python 3
+    unichr = chr
 
 try:
     #raise ImportError  # DEBUG force pypyodbc usage
@@ -49,6 +64,8 @@ def force_bool(in_bool):
         return True
 
 def bool_converter(in_value):
+    if isinstance(in_value, bytes) and not isinstance(in_value, str):
+        in_value = in_value.decode('utf-8')  # py3 converters are passed bytes, str(b'0') is "b'0'"
     return force_bool(in_value)
 
 # TODO uuid
@@ -150,6 +167,75 @@ def sqlite_type_to_python(datatype_name, unknown_type=None):
         result = sqlite_type_dict[datatype_name]
     return result
 
+def quote_identifier(name):
+    """Return delimited (double quoted) SQL identifier, e.g. table or column name"""
+    return '"%s"' % name.replace('"', '""')
+
+FTS_TABLE_PREFIX = 'sqlshite_fts_'  # FTS5 index tables created by SQLshite, hidden from table lists
+
+def fts_table_name(table_name):
+    return FTS_TABLE_PREFIX + table_name
+
+def fts_create_sql_list(table_name, column_names, tokenize='trigram'):
+    """Return list of SQL statements to create an (external content) FTS5 index
+    table on table_name, along with triggers to keep the index in sync with the table.
+    trigram tokenizer (SQLite 3.34+) gives substring matching, like the LIKE '%q%' quick search.
+    """
+    fts_name = fts_table_name(table_name)
+    fts_name_q = quote_identifier(fts_name)
+    table_name_q = quote_identifier(table_name)
+    columns_str = ', '.join(quote_identifier(x) for x in column_names)
+    new_values_str = ', '.join('new.' + quote_identifier(x) for x in column_names)
+    old_values_str = ', '.join('old.' + quote_identifier(x) for x in column_names)
+    return [
+        "CREATE VIRTUAL TABLE %s USING fts5(%s, content=%s, content_rowid='rowid', tokenize='%s')" % (fts_name_q, columns_str, table_name_q, tokenize),
+        'CREATE TRIGGER %s AFTER INSERT ON %s BEGIN INSERT INTO %s (rowid, %s) VALUES (new.rowid, %s); END' % (quote_identifier(fts_name + '_ai'), table_name_q, fts_name_q, columns_str, new_values_str),
+        'CREATE TRIGGER %s AFTER DELETE ON %s BEGIN INSERT INTO %s (%s, rowid, %s) VALUES (\'delete\', old.rowid, %s); END' % (quote_identifier(fts_name + '_ad'), table_name_q, fts_name_q, fts_name_q, columns_str, old_values_str),
+        'CREATE TRIGGER %s AFTER UPDATE ON %s BEGIN INSERT INTO %s (%s, rowid, %s) VALUES (\'delete\', old.rowid, %s); INSERT INTO %s (rowid, %s) VALUES (new.rowid, %s); END' % (quote_identifier(fts_name + '_au'), table_name_q, fts_name_q, fts_name_q, columns_str, old_values_str, fts_name_q, columns_str, new_values_str),
+        "INSERT INTO %s (%s) VALUES ('rebuild')" % (fts_name_q, fts_name_q),  # index existing rows
+    ]
+
+def query_plan_lines(plan):
+    """Returns list of strings, plan (from explain_query_plan()) detail indented by tree depth"""
+    depths = {0: -1}
+    result = []
+    for node_id, parent_id, detail in plan:
+        depth = depths[node_id] = depths.get(parent_id, -1) + 1
+        result.append('  ' * depth + detail)
+    return result
+
+def is_full_scan(detail):
+    """Plan detail is a full table scan (without an index), e.g. 'SCAN t' or older 'SCAN TABLE t'
+    """
+    return detail.startswith('SCAN ') and ' USING ' not in detail and not detail.startswith('SCAN CONSTANT ROW')
+
+def query_plan_full_scans(plan):
+    """Returns list of plan (from explain_query_plan()) details that are full table scans"""
+    return [detail for node_id, parent_id, detail in plan if is_full_scan(detail)]
+
+def prefix_upper_bound(prefix):
+    """Returns smallest string greater than all strings starting with prefix, for an index range scan
+    e.g. 'abc' -> 'abd'. None if there is no such string (empty prefix or last character is the maximum code point)
+    """
+    if not prefix or ord(prefix[-1]) >= sys.maxunicode:
+        return None
+    return prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+INDEX_NAME_PREFIX = 'sqlshite_idx_'  # indexes created by the index advisor
+
+def index_name(table_name, column_name):
+    return '%s%s_%s' % (INDEX_NAME_PREFIX, table_name, column_name)
+
+def rowid_alias_column(schema):
+    """Returns name of the column that is an alias for rowid, or None.
+    Only a single column INTEGER PRIMARY KEY is, not INT PRIMARY KEY nor composite keys.
+    schema is a column type list, see DatabaseWrapper.column_type_list()
+    """
+    pk_columns = [x for x in schema if x[6]]
+    if len(pk_columns) == 1 and (pk_columns[0][2] or '').upper() == 'INTEGER':
+        return pk_columns[0][0]
+    return None
+
 def con2driver(connection_string):
     if connection_string == ':memory:':
         return sqlite3
@@ -166,15 +252,289 @@ def con2driver(connection_string):
         return pyodbc
     return sqlite3
 
+DEFAULT_POOL_TIMEOUT = 30  # seconds to wait for a free connection when pool is exhausted
+DEFAULT_BLOB_CHUNK_SIZE = 64 * 1024  # bytes read per incremental blob read
+DEFAULT_GROUP_COMMIT_SIZE = 100  # maximum writes per (group) commit by a WriteQueue
+DEFAULT_GROUP_COMMIT_DELAY = 0.002  # seconds a WriteQueue waits for more writes before committing a group
+
+class ConnectionPool:
+    """Pool of up to size database connections, connections are created on demand
+    checkout() waits (up to timeout seconds) for a connection to be checked in when all are in use.
+    """
+    def __init__(self, connect_function, size, timeout=DEFAULT_POOL_TIMEOUT):
+        self.connect_function = connect_function
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.Queue()
+        self.all_connections = []
+        self.lock = threading.Lock()
+
+    def checkout(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        self.lock.acquire()
+        try:
+            create_new = len(self.all_connections) < self.size
+            if create_new:
+                con = self.connect_function()
+                self.all_connections.append(con)
+        finally:
+            self.lock.release()
+        if create_new:
+            return con
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError('connection pool exhausted, all %d connections in use' % self.size)
+
+    def checkin(self, con):
+        self.idle.put(con)
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for con in self.all_connections:
+                con.close()
+            self.all_connections = []
+            self.idle = queue.Queue()
+        finally:
+            self.lock.release()
+
+class WriteRequest:
+    def __init__(self, write_function):
+        self.write_function = write_function
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class WriteQueue:
+    """Single writer thread for a database, with its own connection. Writes are queued and run in order,
+    then committed in groups of up to max_batch writes, or whatever has arrived max_delay seconds after
+    the group's first write. A single writer means no "database is locked" between writers, and one
+    commit (fsync) is shared by the whole group.
+    Each write runs in a savepoint, an exception only rolls back (and is raised for) that write.
+    If the writer thread can not connect, queued and later writes raise that error.
+    """
+    def __init__(self, connect_function, max_batch=DEFAULT_GROUP_COMMIT_SIZE, max_delay=DEFAULT_GROUP_COMMIT_DELAY, name='sqlshite-writer'):
+        self.connect_function = connect_function
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.stopping = False
+        self.error = None  # set if the writer thread failed to start
+        self.lock = threading.Lock()  # so no request is queued after a failed start has emptied the queue
+        self.commit_count = 0
+        self.write_count = 0
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Commit queued writes and stop the writer thread"""
+        self.requests.put(None)
+        self.thread.join()
+
+    def submit(self, write_function):
+        """Queue write_function(connection) and wait until it has been committed. Returns its result, or raises its exception
+        """
+        if self.stopping:
+            raise RuntimeError('write queue is stopped')
+        request = WriteRequest(write_function)
+        self.lock.acquire()
+        try:
+            if self.error is not None:
+                raise self.error
+            self.requests.put(request)
+        finally:
+            self.lock.release()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def next_group(self):
+        """Returns list of WriteRequest, blocks for the first one. Empty list when stopping"""
+        request = self.requests.get()
+        if request is None:
+            self.stopping = True
+            return []
+        group = [request]
+        deadline = time.time() + self.max_delay
+        while len(group) < self.max_batch:
+            try:
+                timeout = deadline - time.time()
+                if timeout > 0:
+                    request = self.requests.get(timeout=timeout)
+                else:
+                    request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.stopping = True
+                break
+            group.append(request)
+        return group
+
+    def run(self):
+        try:
+            connection = self.connect_function()  # created (and only used) in the writer thread
+        except Exception as info:
+            log.error('write queue failed to connect %r', info)
+            self.lock.acquire()
+            try:
+                self.error = info
+                while not self.requests.empty():
+                    request = self.requests.get_nowait()
+                    if request is not None:
+                        request.error = info
+                        request.done.set()
+            finally:
+                self.lock.release()
+            return
+        try:
+            while True:
+                group = self.next_group()
+                if group:
+                    self.write_group(connection, group)
+                if self.stopping:
+                    if self.requests.empty():
+                        break
+        finally:
+            connection.close()
+
+    def write_group(self, connection, group):
+        cursor = connection.cursor()
+        try:
+            cursor.execute('BEGIN')  # otherwise each (outermost) savepoint release is a commit
+            for request in group:
+                cursor.execute('SAVEPOINT sqlshite_write')
+                try:
+                    request.result = request.write_function(connection)
+                    cursor.execute('RELEASE sqlshite_write')
+                except Exception as info:
+                    request.error = info
+                    cursor.execute('ROLLBACK TO sqlshite_write')
+                    cursor.execute('RELEASE sqlshite_write')
+            connection.commit()
+            self.commit_count += 1
+            self.write_count += len(group)
+        except Exception as info:
+            log.error('group commit of %d writes failed %r', len(group), info)
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            for request in group:
+                if request.error is None:
+                    request.error = info
+        finally:
+            cursor.close()
+            for request in group:
+                request.done.set()
+
 class DatabaseWrapper:
-    def __init__(self, connection_string, driver=None):
+    def __init__(self, connection_string, driver=None, pool_size=None, check_same_thread=None, pool_timeout=DEFAULT_POOL_TIMEOUT):
+        """@pool_size if set, use a pool of (up to) pool_size connections. Each thread checks out
+            its own connection (and a fresh cursor) on first use of .connection/.cursor and returns it
+            with release(), so concurrent requests do not share a cursor.
+            Ignored for :memory: databases (each connection would be a different database).
+        @check_same_thread sqlite3 only, passed to sqlite3.connect(). Defaults to False when pooled as
+            a connection may be used by different threads (one at a time)
+        """
         self.connection_string = connection_string
         self.driver = driver
-        self.connection = None
-        self.cursor = None
+        if connection_string == ':memory:':
+            pool_size = None
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        if check_same_thread is None and pool_size:
+            check_same_thread = False
+        self.check_same_thread = check_same_thread
+        self.pool = None
+        self.thread_local = threading.local()
+        self._connection = None
+        self._cursor = None
+        self.write_queue = None
+
+    @property
+    def connection(self):
+        if self.pool is None:
+            return self._connection
+        con = getattr(self.thread_local, 'connection', None)
+        if con is None:
+            con = self.pool.checkout()
+            self.thread_local.connection = con
+        return con
+
+    @property
+    def cursor(self):
+        if self.pool is None:
+            return self._cursor
+        cursor = getattr(self.thread_local, 'cursor', None)
+        if cursor is None:
+            cursor = self.connection.cursor()
+            self.thread_local.cursor = cursor
+        return cursor
+
+    def release(self):
+        """Return connection used by current thread (if any) to the pool, committing any pending changes.
+        If not pooled, commits any pending changes on the shared connection, so its write lock is not held
+        past the request (e.g. SQL editor writes), which would block write() calls on the write queue.
+        """
+        if self.pool is None:
+            con = self._connection
+            if con is not None and getattr(con, 'in_transaction', True):  # Python 2 sqlite3 and other drivers do not have in_transaction, always commit
+                try:
+                    con.commit()
+                except:
+                    con.rollback()
+                    raise
+            return
+        con = getattr(self.thread_local, 'connection', None)
+        if con is None:
+            return
+        cursor = getattr(self.thread_local, 'cursor', None)
+        self.thread_local.cursor = None
+        self.thread_local.connection = None
+        try:
+            if cursor is not None:
+                cursor.close()
+            con.commit()
+        finally:
+            self.pool.checkin(con)
+
+    def start_write_queue(self, max_batch=DEFAULT_GROUP_COMMIT_SIZE, max_delay=DEFAULT_GROUP_COMMIT_DELAY):
+        """Send write() calls to a single writer thread (WriteQueue) with group commit.
+        Not for :memory: databases, the writer's connection would be a different database.
+        """
+        if self.connection_string == ':memory:':
+            raise NotImplementedError('write queue not supported for :memory: databases')
+        self.driver = self.driver or con2driver(self.connection_string)
+        self.write_queue = WriteQueue(self._connect, max_batch=max_batch, max_delay=max_delay)
+        self.write_queue.start()
+
+    def write(self, write_function):
+        """Returns write_function(connection), which should only use the connection passed to it (not self.cursor)
+        and not commit. Returns after the write is committed; by the write queue (if started, see start_write_queue())
+        or the current thread's connection.
+        """
+        if self.write_queue is not None:
+            return self.write_queue.submit(write_function)
+        connection = self.connection
+        try:
+            result = write_function(connection)
+        except:
+            connection.rollback()
+            raise
+        connection.commit()
+        return result
 
     def is_open(self, hard_fail=True):
-        if self.connection:
+        if self._connection or self.pool:
             return True
         if hard_fail:
             raise NotImplementedError('Database is not open')
@@ -182,27 +542,46 @@ class DatabaseWrapper:
 
     # TODO del method
     def do_disconnect(self):
+        if self.write_queue is not None:
+            self.write_queue.stop()
+            self.write_queue = None
         #if self.connection:
         if self.is_open():
+            if self.pool:
+                self.thread_local = threading.local()
+                self.pool.close()
+                self.pool = None
+                return
             try:
-                self.cursor.close()
-                self.cursor = None
+                self._cursor.close()
+                self._cursor = None
             finally:
-                self.connection.close()
-                self.connection = None
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self):
+        """Returns a new (raw) database connection"""
+        connection_string = self.connection_string
+        db_driver = self.driver
+        if db_driver == sqlite3:
+            kwargs = {}
+            if self.check_same_thread is not None:
+                kwargs['check_same_thread'] = self.check_same_thread
+            con = db_driver.connect(connection_string, detect_types=sqlite3.PARSE_DECLTYPES, **kwargs)  # sqlite3 only
+        else:
+            con = db_driver.connect(connection_string)
+        return con
 
     def do_connect(self):
-        if self.connection is None:
-            connection_string = self.connection_string
-            db_driver = self.driver or con2driver(self.connection_string)
-            if db_driver == sqlite3:
-                con = db_driver.connect(connection_string, detect_types=sqlite3.PARSE_DECLTYPES)  # sqlite3 only
-            else:
-                con = db_driver.connect(connection_string)
+        if self._connection is None and self.pool is None:
+            self.driver = self.driver or con2driver(self.connection_string)
+            if self.pool_size:
+                self.pool = ConnectionPool(self._connect, self.pool_size, timeout=self.pool_timeout)
+                return
+            con = self._connect()
             cursor = con.cursor()
-            self.driver = db_driver
-            self.connection = con
-            self.cursor = cursor
+            self._connection = con
+            self._cursor = cursor
             if self.connection_string == ':memory:' :  #  sqlite3 only
                 # demo objects
                 cursor.execute("""
@@ -254,6 +633,104 @@ class DatabaseWrapper:
         # alternatively https://www.sqlite.org/pragma.html#pragma_table_list
         return [x[0] for x in self.cursor.fetchall()]
 
+    def table_definitions(self):
+        """Returns dictionary of table name to CREATE TABLE statement, sqlite3 only
+        """
+        if not self.is_open():
+            raise NotImplementedError('Database is not open')
+        if self.driver != sqlite3:
+            raise NotImplementedError('non-SQLlite3 database %r' % self.driver)
+        self.cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
+        return dict(self.cursor.fetchall())
+
+    def schema_version(self):
+        """Returns PRAGMA schema_version, incremented by SQLite3 on every schema change (from any connection/process)
+        """
+        self.cursor.execute('PRAGMA schema_version')
+        return self.cursor.fetchone()[0]
+
+    def data_version(self):
+        """Returns PRAGMA data_version for the current (thread's) connection, changes when
+        another connection (or process) commits a change to the database.
+        NOTE does NOT change for commits made by this connection
+        """
+        self.cursor.execute('PRAGMA data_version')
+        return self.cursor.fetchone()[0]
+
+    def index_list(self, table_name):
+        """Returns list of dicts (name, unique, origin, partial, columns) for indexes on table_name,
+        from PRAGMA index_list and index_info (as table-valued functions, one query).
+        columns is in index order, None entries are expressions. origin is 'c' (CREATE INDEX), 'u' (UNIQUE) or 'pk'
+        """
+        if self.driver != sqlite3:
+            raise NotImplementedError('non-SQLlite3 database %r' % self.driver)
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute('''SELECT il.name, il."unique", il.origin, il.partial, ii.name
+                FROM pragma_index_list(?) AS il JOIN pragma_index_info(il.name) AS ii
+                ORDER BY il.seq, ii.seqno''', (table_name,))
+            indexes = {}
+            result = []
+            for index_name, unique, origin, partial, column_name in cursor.fetchall():
+                index = indexes.get(index_name)
+                if index is None:
+                    index = indexes[index_name] = {'name': index_name, 'unique': bool(unique), 'origin': origin, 'partial': bool(partial), 'columns': []}
+                    result.append(index)
+                index['columns'].append(column_name)
+            return result
+        finally:
+            cursor.close()
+
+    def explain_query_plan(self, sql, bind_parameters=None, connection=None):
+        """Returns list of (id, parent, detail) tuples from EXPLAIN QUERY PLAN, see query_plan_lines()
+        Uses a new cursor, so safe to call while self.cursor has pending rows.
+        connection defaults to the current thread's, pass it from within write() functions.
+        """
+        cursor = (connection or self.connection).cursor()
+        try:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, bind_parameters or ())
+            return [(row[0], row[1], row[-1]) for row in cursor.fetchall()]  # older SQLite versions have 4 columns, last is detail
+        finally:
+            cursor.close()
+
+    def blob_chunks(self, table_name, column_name, rowid, offset=0, length=None, chunk_size=DEFAULT_BLOB_CHUNK_SIZE):
+        """Generator, yields (bytes) chunks of a column value, length bytes (default to the end) starting at offset.
+        Uses incremental BLOB I/O, Connection.blobopen() (Python 3.11+, TEXT or BLOB values) so only chunk_size
+        bytes are in memory at a time, otherwise falls back to a substr() query per chunk.
+        NOTE the blob handle is invalidated (OperationalError) if the row is changed while reading.
+        """
+        connection = self.connection
+        if hasattr(connection, 'blobopen'):
+            blob = connection.blobopen(table_name, column_name, rowid, readonly=True)
+            try:
+                if length is None:
+                    length = len(blob) - offset
+                blob.seek(offset)
+                while length > 0:
+                    chunk = blob.read(min(chunk_size, length))
+                    if not chunk:
+                        break
+                    length -= len(chunk)
+                    yield chunk
+            finally:
+                blob.close()
+            return
+        sql = 'SELECT substr(CAST(%s AS BLOB), ?, ?) FROM %s WHERE rowid = ?' % (quote_identifier(column_name), quote_identifier(table_name))
+        cursor = connection.cursor()
+        try:
+            position = offset
+            while length is None or position < offset + length:
+                read_size = chunk_size if length is None else min(chunk_size, offset + length - position)
+                cursor.execute(sql, (position + 1, read_size, rowid))  # substr() is 1-based
+                row = cursor.fetchone()
+                chunk = row and row[0]
+                if not chunk:
+                    break
+                position += len(chunk)
+                yield bytes(chunk)
+        finally:
+            cursor.close()
+
     def column_type_list(self, table_name):
         # Assume single schema/current user with unqualified object names
         # TODO make this an attribute?
@@ -271,19 +748,41 @@ class DatabaseWrapper:
             result = []
             meta = self.cursor.execute("PRAGMA table_info('%s')" % table_name)
             for row in meta:
-                # FIXME have a length (TODO Precision and scale later for decimal)
-                # TODO use namedtupled
-                column_id, column_name, column_type, column_notnull, column_default_value, column_primary_key = row
-                column_primary_key = bool(column_primary_key)
-                python_type = sqlite_type_to_python(column_type, unknown_type=str)  # TODO make an option?
-                dbms_type = column_type
-                is_nullable = not column_notnull
-                length_or_precision = sql_type_length(dbms_type)
-                #print(row)
-                result.append((column_name, python_type, dbms_type, is_nullable, length_or_precision, column_default_value, column_primary_key))
+                result.append(sqlite_table_info_to_column_type(row))
             return result
             # Alternative idea, pull a row back and look at Python type, only works for non-NULL values and needs at least one row in table
 
+    def all_column_type_lists(self):
+        """Returns dictionary of table name to column_type_list() for all tables, using a single query
+        (rather than a PRAGMA table_info per table). SQLite3 3.16+ only (pragma table-valued functions)
+        """
+        if not self.is_open():
+            raise NotImplementedError('Database is not open')
+        if self.driver != sqlite3:
+            raise NotImplementedError('non-SQLlite3 database %r' % self.driver)
+        result = {}
+        self.cursor.execute("""SELECT m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk
+            FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+            WHERE m.type='table'
+            ORDER BY m.name, p.cid""")
+        for row in self.cursor.fetchall():
+            result.setdefault(row[0], []).append(sqlite_table_info_to_column_type(row[1:]))
+        return result
+
+def sqlite_table_info_to_column_type(row):
+    """Convert row from SQLite3 PRAGMA table_info into column_type_list() entry tuple
+    (column_name, python_type, dbms_type, is_nullable, length_or_precision, column_default_value, column_primary_key)
+    """
+    # FIXME have a length (TODO Precision and scale later for decimal)
+    # TODO use namedtupled
+    column_id, column_name, column_type, column_notnull, column_default_value, column_primary_key = row
+    column_primary_key = bool(column_primary_key)
+    python_type = sqlite_type_to_python(column_type, unknown_type=str)  # TODO make an option?
+    dbms_type = column_type
+    is_nullable = not column_notnull
+    length_or_precision = sql_type_length(dbms_type)
+    return (column_name, python_type, dbms_type, is_nullable, length_or_precision, column_default_value, column_primary_key)
+
 # https://github.com/jsonform/jsonform/wiki#schema-supported
 python_type_to_jsonform_type = {
     str: "string",
@@ -394,27 +893,238 @@ def generate_jsonforms_schema(table_name, column_type_list):
     return result
 
 class DataAccessLayer:
-    def __init__(self, db_connection, name=None, TODO=None):
+    def __init__(self, db_connection, name=None, config=None):
         """@db_connection is an object of type DatabaseWrapper() that is already connected
+        @config optional dictionary of (per database) settings
         """
         db = db_connection
         self.db = db
         self.name = name
+        self.config = config or {}
+        self.fts = {}  # table name -> FTS5 index table name
+        self.schema_lock = threading.Lock()
         self.scan_schema()
+        self.setup_fts()
+
+    def table_setting(self, table_name, key, default=None):
+        """Lookup per table setting from config, e.g.
+            {"tables": {"my_numbers": {"quick_search_column": "english", "fts": true}}}
+        """
+        return self.config.get('tables', {}).get(table_name, {}).get(key, default)
+
+    def setup_fts(self):
+        """Create (if missing) FTS5 full text indexes for tables configured with "fts": true
+        Indexes "fts_columns" if set, otherwise all string columns.
+        Triggers keep the index up to date, including for changes made by other processes.
+        TODO detect column changes and recreate index
+        """
+        db = self.db
+        existing_tables = db.table_list()
+        for table_name in self.schema:
+            if not self.table_setting(table_name, 'fts'):
+                continue
+            fts_name = fts_table_name(table_name)
+            if fts_name not in existing_tables:
+                column_names = self.table_setting(table_name, 'fts_columns')
+                if not column_names:
+                    column_names = [x[0] for x in self.schema[table_name] if x[1] is str]
+                if not column_names:
+                    log.warning('fts: no string columns in table %r, skipping', table_name)
+                    continue
+                log.info('fts: creating index %r on %r %r', fts_name, table_name, column_names)
+
+                def write(connection, sql_list=fts_create_sql_list(table_name, column_names)):
+                    cursor = connection.cursor()
+                    try:
+                        for sql in sql_list:
+                            cursor.execute(sql)
+                    finally:
+                        cursor.close()
+                try:
+                    db.write(write)  # rolled back on error
+                except db.driver.Error as info:
+                    # e.g. FTS5 or trigram tokenizer not available in this SQLite3 build
+                    log.error('fts: unable to create index for %r: %r', table_name, info)
+                    continue
+            self.fts[table_name] = fts_name
+
+    def quick_search_column(self, table_name):
+        """Column used for (LIKE) quick search, "quick_search_column" table setting or first string column
+        """
+        column_name = self.table_setting(table_name, 'quick_search_column')
+        if column_name is None:
+            for metadata in self.schema.get(table_name, []):
+                if metadata[1] is str:
+                    column_name = metadata[0]
+                    break
+        return column_name
+
+    def index_advice(self):
+        """Index advisor, returns list of dicts, one per table column that is searched, sorted, or paged on:
+            table_name, column_name, purpose, index_name (None if missing, leading column of an index only), create_sql
+        Checks quick search column (unless table uses FTS), "sort_columns" table setting, and rowid (paging).
+        """
+        result = []
+        for table_name in sorted(self.schema):
+            schema = self.schema[table_name]
+            rowid_alias = rowid_alias_column(schema)  # INTEGER PRIMARY KEY, is the rowid
+            leading_columns = {}  # column name -> index name
+            for index in reversed(self.db.index_list(table_name)):  # first index wins
+                if index['columns'][0] is not None and not index['partial']:
+                    leading_columns[index['columns'][0]] = index['name']
+            wanted = [('rowid', 'paging')]
+            if table_name not in self.fts:
+                column_name = self.quick_search_column(table_name)
+                if column_name:
+                    wanted.append((column_name, 'quick search'))
+            for column_name in self.table_setting(table_name, 'sort_columns') or []:
+                wanted.append((column_name, 'sort'))
+            for column_name, purpose in wanted:
+                if column_name == 'rowid' or column_name == rowid_alias:
+                    existing_index_name = 'rowid (table b-tree)'
+                else:
+                    existing_index_name = leading_columns.get(column_name)
+                result.append({
+                    'table_name': table_name,
+                    'column_name': column_name,
+                    'purpose': purpose,
+                    'index_name': existing_index_name,
+                    'create_sql': None if existing_index_name else 'CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (quote_identifier(index_name(table_name, column_name)), quote_identifier(table_name), quote_identifier(column_name)),
+                })
+        return result
+
+    def create_index(self, table_name, column_name):
+        """Create (single column) index suggested by index_advice(), returns index name
+        """
+        if table_name not in self.schema or column_name not in [x[0] for x in self.schema[table_name]]:
+            raise KeyError('unknown table/column %r %r' % (table_name, column_name))
+        name = index_name(table_name, column_name)
+        sql = 'CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (quote_identifier(name), quote_identifier(table_name), quote_identifier(column_name))
+        log.info('creating index: %s', sql)
+
+        def write(connection):
+            cursor = connection.cursor()
+            try:
+                cursor.execute(sql)
+            finally:
+                cursor.close()
+        self.db.write(write)
+        return name
+
+    def prefix_search_sql(self, table_name, column_name, search_term, limit, select_list='*'):
+        """Returns (sql, bind_parameters) for a prefix search of column_name, first limit rows in column order.
+        Range predicate (column >= term AND column < next term) rather than LIKE, so an index
+        on the column is used for both the search and the order by, i.e. an index seek not a table scan.
+        NOTE case sensitive (BINARY collation), unlike LIKE
+        select_list is the columns to return (after rowid)
+        """
+        column_name_q = quote_identifier(table_name) + '.' + quote_identifier(column_name)  # qualified, not a select_list alias
+        conditions = ['%s >= ?' % column_name_q]
+        bind_parameters = [search_term]
+        upper_bound = prefix_upper_bound(search_term)
+        if upper_bound is not None:
+            conditions.append('%s < ?' % column_name_q)
+            bind_parameters.append(upper_bound)
+        sql = 'select rowid as sqlite_rowid, %s from %s where %s order by %s limit ?' % (select_list, quote_identifier(table_name), ' and '.join(conditions), column_name_q)
+        bind_parameters.append(limit)
+        return sql, tuple(bind_parameters)
+
+    def fts_search_sql(self, table_name, search_term, limit, select_list='t.*'):
+        """Returns (sql, bind_parameters) for a full text (substring) search of table_name, top limit rows by bm25 rank
+        or None if there is no FTS index for the table (or the search term is too short for trigram).
+        select_list is the columns to return (after rowid), table_name is aliased as t
+        """
+        fts_name = self.fts.get(table_name)
+        if not fts_name or len(search_term) < 3:
+            # trigram needs at least 3 characters to match
+            return None
+        fts_name_q = quote_identifier(fts_name)
+        sql = 'select t.rowid as sqlite_rowid, %s from %s join %s as t on t.rowid = %s.rowid where %s match ? order by bm25(%s) limit ?' % (select_list, fts_name_q, quote_identifier(table_name), fts_name_q, fts_name_q, fts_name_q)
+        match_str = '"%s"' % search_term.replace('"', '""')  # phrase, i.e. substring not FTS5 query syntax
+        return sql, (match_str, limit)
+
+    def refresh_schema(self):
+        """Cheap check (PRAGMA schema_version) for schema changes, e.g. made by another process or the SQL editor.
+        If changed, only tables that are new or have a different definition are re-introspected.
+        Returns True if schema changed
+        """
+        db = self.db
+        schema_version = db.schema_version()
+        if schema_version == self.schema_version:
+            return False
+        self.schema_lock.acquire()
+        try:
+            if schema_version == self.schema_version:
+                return False  # another thread already refreshed
+            table_sql = db.table_definitions()
+            db_schema = dict(self.schema)
+            db_schema_jsonform = dict(self.jsonform)
+            for tname in list(db_schema):
+                if tname not in table_sql:
+                    log.info('schema change, table dropped %r', tname)
+                    del db_schema[tname]
+                    db_schema_jsonform.pop(tname, None)
+                    self.jsonform_json.pop(tname, None)
+                    self.fts.pop(tname, None)
+            for tname in table_sql:
+                if tname.startswith(FTS_TABLE_PREFIX):
+                    continue
+                if tname in db_schema and self.table_sql.get(tname) == table_sql[tname]:
+                    continue
+                log.info('schema change, rescan table %r', tname)
+                db_schema[tname] = db.column_type_list(tname)
+                db_schema_jsonform.pop(tname, None)  # regenerated on next get_jsonform()
+                self.jsonform_json.pop(tname, None)
+            # replace (rather than update) so other threads always see a complete schema
+            self.schema = db_schema
+            self.jsonform = db_schema_jsonform
+            self.table_sql = table_sql
+            self.schema_version = schema_version
+        finally:
+            self.schema_lock.release()
+        return True
 
     def scan_schema(self):
         db = self.db
-        table_list = db.table_list()  # list of table names only, no schema/owner
-        db_schema = {}
-        db_schema_jsonform = {}
-        for tname in table_list:
-            print('********** table: %s' % tname)
-            clist = db.column_type_list(tname)
-            db_schema[tname] = clist
-            db_schema_jsonform[tname] = generate_jsonform_schema(tname, clist)
+        self.schema_version = db.schema_version()
+        self.table_sql = db.table_definitions()
+        db_schema = db.all_column_type_lists()  # one query for all tables
+        for tname in list(db_schema):
+            if tname.startswith(FTS_TABLE_PREFIX):
+                del db_schema[tname]  # SQLshite FTS index (and FTS5 shadow) tables
+        log.info('scanned schema for %d tables', len(db_schema))
 
         self.schema = db_schema
-        self.jsonform = db_schema_jsonform
+        self.jsonform = {}  # generated on demand, see get_jsonform()
+        self.jsonform_json = {}  # table name -> (json bytes, etag), see get_jsonform_json()
+
+    def get_jsonform(self, table_name):
+        """Returns jsonform schema for table_name (or None if table does not exist), generated on first use
+        """
+        jsonform = self.jsonform.get(table_name)
+        if jsonform is None:
+            clist = self.schema.get(table_name)
+            if clist is None:
+                return None
+            jsonform = generate_jsonform_schema(table_name, clist)
+            self.jsonform[table_name] = jsonform
+        return jsonform
+
+    def get_jsonform_json(self, table_name):
+        """Returns (json bytes, etag) for jsonform schema for table_name, or (None, None) if table does not exist.
+        Serialized (compact) once and cached until the table schema changes.
+        etag is a strong HTTP ETag (quoted string) based on the content.
+        """
+        cached = self.jsonform_json.get(table_name)
+        if cached is None:
+            jsonform = self.get_jsonform(table_name)
+            if jsonform is None:
+                return None, None
+            json_bytes = json.dumps(jsonform, separators=(',', ':'), default=str).encode('utf-8')
+            etag = '"%s"' % hashlib.sha1(json_bytes).hexdigest()
+            cached = (json_bytes, etag)
+            self.jsonform_json[table_name] = cached
+        return cached
 
 def main(argv=None):
     if argv is None:
@@ -453,7 +1163,6 @@ def main(argv=None):
 
     dal = DataAccessLayer(db)
     db_schema = dal.schema
-    db_schema_jsonform = dal.jsonform
     """
     print('db_schema_jsonform= %r' % db_schema_jsonform)
     print('db_schema= %r' % db_schema)
@@ -489,7 +1198,7 @@ def main(argv=None):
             # See https://github.com/jsonform/jsonform/wiki#previous
             # TODO generate_jsonform_schema(), add optional data/value parameter
             #jsonform = generate_jsonform_schema(table_name, column_type_list)
-            jsonform = copy.copy(db_schema_jsonform[table_name])
+            jsonform = copy.copy(dal.get_jsonform(table_name))
             jsonform['value'] = row_dict
             print('%s' % json.dumps(jsonform, indent=4, default=str))  # TODO date, datetime serialization - both directions
 
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+"""Streaming bulk import of CSV (with header row) or NDJSON (one json object per line) into a table.
+Input is parsed a line at a time and inserted in batches (one transaction and executemany() per batch)
+so memory use is bounded by the batch size, not the input size.
+
+    python -m sqlshite.importer DATABASE TABLE_NAME FILENAME [BATCH_SIZE]
+
+FILENAME ending in .ndjson, .jsonl or .json is NDJSON, otherwise CSV. Use - for stdin (CSV).
+"""
+
+import codecs
+import csv
+import json
+import logging
+import sqlite3
+import sys
+import time
+
+try:
+    from datetime import date, datetime
+    date.fromisoformat  # py3.7+
+except AttributeError:
+    date = datetime = None
+
+import sqlshite
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_IMPORT_BATCH_SIZE = 10000  # rows per transaction
+DEFAULT_READ_SIZE = 64 * 1024  # bytes read from input at a time
+MAX_ERROR_MESSAGES = 20  # number of row errors kept for the summary
+
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl', '.json')
+
+
+try:
+    unicode
+except NameError:
+    # Python 3
+    unicode = str
+
+
+def iter_text_lines(stream, length=None, encoding='utf-8-sig', read_size=DEFAULT_READ_SIZE):
+    """Generator, yields lines (with line endings, as csv.reader expects) from a binary stream
+    (e.g. wsgi.input or a file), reading read_size bytes at a time and at most length bytes (if set,
+    e.g. CONTENT_LENGTH as wsgi.input may block at end of body). Default encoding skips a UTF-8 BOM.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    while length is None or length > 0:
+        data = stream.read(read_size if length is None else min(read_size, length))
+        if not data:
+            break
+        if length is not None:
+            length -= len(data)
+        pending += decoder.decode(data)
+        lines = pending.split('\n')  # not splitlines(), it also splits on characters that are valid inside csv values
+        pending = lines.pop()  # incomplete (or empty) last line
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', True)
+    if pending:
+        yield pending
+
+
+def coerce_function(python_type):
+    """Returns function to convert a (string) input value for a column of python_type, see
+    DatabaseWrapper.column_type_list(). Values that are not strings (e.g. NDJSON numbers) are returned as-is.
+    Dates and datetimes are validated and stored as ISO 8601 text, as read back by the registered converters.
+    """
+    def to_none(value):
+        if value == '':
+            return None  # CSV has no NULL, empty means missing for non-text columns
+        return value
+
+    if python_type is int:
+        def coerce(value):
+            value = to_none(value)
+            if isinstance(value, unicode):
+                return int(value)
+            return value
+    elif python_type is float:
+        def coerce(value):
+            value = to_none(value)
+            if isinstance(value, unicode):
+                return float(value)
+            return value
+    elif python_type is bool:
+        def coerce(value):
+            value = to_none(value)
+            if isinstance(value, unicode):
+                return sqlshite.force_bool(value)
+            return value
+    elif date is not None and python_type is datetime:
+        def coerce(value):
+            value = to_none(value)
+            if isinstance(value, unicode):
+                return datetime.fromisoformat(value.replace('Z', '+00:00')).isoformat(' ')
+            return value
+    elif date is not None and python_type is date:
+        def coerce(value):
+            value = to_none(value)
+            if isinstance(value, unicode):
+                return date.fromisoformat(value).isoformat()
+            return value
+    else:
+        def coerce(value):
+            return value
+    return coerce
+
+
+class TableImporter:
+    """Insert rows (dicts of column name to value) into table_name, batch_size rows per transaction.
+    Rows are grouped by column set within a batch, one executemany() per group. A group that fails
+    (e.g. constraint violation) is retried one row at a time, bad rows are counted and skipped.
+    progress, if set, is called with the summary dict after each batch is committed.
+    """
+    def __init__(self, db, table_name, batch_size=DEFAULT_IMPORT_BATCH_SIZE, progress=None):
+        self.db = db
+        self.table_name = table_name
+        self.batch_size = batch_size or DEFAULT_IMPORT_BATCH_SIZE
+        self.progress = progress
+        column_type_list = db.column_type_list(table_name)
+        if not column_type_list:
+            raise KeyError('no such table %r' % table_name)
+        self.coercers = dict((x[0], coerce_function(x[1])) for x in column_type_list)
+        self.statements = {}  # tuple of column names -> INSERT statement
+        self.pending = {}  # tuple of column names -> list of (line number, bind parameters)
+        self.pending_count = 0
+        self.start_time = time.time()
+        self.rows_read = 0
+        self.rows_inserted = 0
+        self.error_count = 0
+        self.errors = []  # first MAX_ERROR_MESSAGES (line number, message)
+
+    def error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERROR_MESSAGES:
+            self.errors.append((line_number, message))
+
+    def check_columns(self, column_names):
+        """Raises ValueError for column names not in the table"""
+        unknown = [x for x in column_names if x not in self.coercers]
+        if unknown:
+            raise ValueError('unknown columns %r' % unknown)
+
+    def add(self, line_number, row):
+        """Queue a row (dict) for insert, writes a batch when batch_size rows are pending"""
+        self.rows_read += 1
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('row must be an object')
+            column_names = tuple(sorted(row))
+            self.check_columns(column_names)
+            bind_parameters = tuple(self.coercers[x](row[x]) for x in column_names)
+        except (ValueError, TypeError) as info:
+            self.error(line_number, str(info))
+            return
+        self.pending.setdefault(column_names, []).append((line_number, bind_parameters))
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def statement(self, column_names):
+        sql = self.statements.get(column_names)
+        if sql is None:
+            table_name_q = sqlshite.quote_identifier(self.table_name)
+            if column_names:
+                sql = 'INSERT INTO %s (%s) VALUES (%s)' % (table_name_q, ', '.join(sqlshite.quote_identifier(x) for x in column_names), ', '.join(['?'] * len(column_names)))
+            else:
+                sql = 'INSERT INTO %s DEFAULT VALUES' % table_name_q
+            self.statements[column_names] = sql
+        return sql
+
+    def write_pending(self, connection):
+        """Write function for DatabaseWrapper.write(), inserts pending rows.
+        Returns (rows inserted, list of (line number, error message)).
+        """
+        rows_inserted = 0
+        errors = []
+        cursor = connection.cursor()
+        try:
+            if not connection.in_transaction:
+                cursor.execute('BEGIN')  # otherwise each (outermost) savepoint release is a commit
+            for column_names, group_rows in self.pending.items():
+                sql = self.statement(column_names)
+                cursor.execute('SAVEPOINT sqlshite_import')
+                try:
+                    cursor.executemany(sql, [x[1] for x in group_rows])
+                    cursor.execute('RELEASE sqlshite_import')
+                    rows_inserted += len(group_rows)
+                    continue
+                except sqlite3.Error as info:
+                    log.info('import batch failed (%s), retrying one row at a time', info)
+                    cursor.execute('ROLLBACK TO sqlshite_import')
+                for line_number, bind_parameters in group_rows:
+                    try:
+                        cursor.execute(sql, bind_parameters)
+                        rows_inserted += 1
+                    except sqlite3.Error as info:
+                        errors.append((line_number, str(info)))
+                cursor.execute('RELEASE sqlshite_import')
+        finally:
+            cursor.close()
+        return rows_inserted, errors
+
+    def flush(self):
+        """Write pending rows in a single transaction, see DatabaseWrapper.write()"""
+        if not self.pending:
+            return
+        rows_inserted, errors = self.db.write(self.write_pending)
+        self.rows_inserted += rows_inserted
+        for line_number, message in errors:
+            self.error(line_number, message)
+        self.pending = {}
+        self.pending_count = 0
+        if self.progress:
+            self.progress(self.summary())
+
+    def summary(self):
+        seconds = time.time() - self.start_time
+        return {
+            'table_name': self.table_name,
+            'rows_read': self.rows_read,
+            'rows_inserted': self.rows_inserted,
+            'errors': self.error_count,
+            'error_messages': ['line %d: %s' % x for x in self.errors],
+            'seconds': round(seconds, 3),
+            'rows_per_second': int(self.rows_inserted / seconds) if seconds else None,
+        }
+
+    def finish(self):
+        """Write any pending rows, returns summary dict"""
+        self.flush()
+        return self.summary()
+
+
+def import_csv(importer, lines):
+    """Import CSV lines (first row is column names) with importer (TableImporter), returns summary dict"""
+    reader = csv.reader(lines)
+    try:
+        header = next(reader)
+    except StopIteration:
+        return importer.finish()
+    header = [x.strip() for x in header]
+    importer.check_columns(header)
+    for row in reader:
+        if not row:
+            continue  # blank line
+        if len(row) != len(header):
+            importer.rows_read += 1
+            importer.error(reader.line_num, 'expected %d values, got %d' % (len(header), len(row)))
+            continue
+        importer.add(reader.line_num, dict(zip(header, row)))
+    return importer.finish()
+
+
+def import_ndjson(importer, lines):
+    """Import NDJSON lines (one json object per line) with importer (TableImporter), returns summary dict"""
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as info:
+            importer.rows_read += 1
+            importer.error(line_number, 'invalid json: %s' % info)
+            continue
+        importer.add(line_number, row)
+    return importer.finish()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        connection_string, table_name, filename = argv[1:4]
+    except ValueError:
+        print('Usage: %s DATABASE TABLE_NAME FILENAME [BATCH_SIZE]' % argv[0])
+        return 1
+    batch_size = int(argv[4]) if len(argv) > 4 else DEFAULT_IMPORT_BATCH_SIZE
+
+    def progress(summary):
+        sys.stderr.write('%d rows inserted, %d errors, %s rows/sec\n' % (summary['rows_inserted'], summary['errors'], summary['rows_per_second']))
+
+    db = sqlshite.DatabaseWrapper(connection_string)
+    db.do_connect()
+    try:
+        importer = TableImporter(db, table_name, batch_size=batch_size, progress=progress)
+        if filename == '-':
+            stream = getattr(sys.stdin, 'buffer', sys.stdin)
+        else:
+            stream = open(filename, 'rb')
+        try:
+            if filename.lower().endswith(NDJSON_EXTENSIONS):
+                summary = import_ndjson(importer, iter_text_lines(stream))
+            else:
+                summary = import_csv(importer, iter_text_lines(stream))
+        finally:
+            if stream is not getattr(sys.stdin, 'buffer', sys.stdin):
+                stream.close()
+    finally:
+        db.do_disconnect()
+    for message in summary['error_messages']:
+        print(message)
+    print('%d rows read, %d inserted, %d errors in %.3f seconds (%s rows/sec)' % (summary['rows_read'], summary['rows_inserted'], summary['errors'], summary['seconds'], summary['rows_per_second']))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
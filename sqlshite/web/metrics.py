@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+"""Request metrics; latency histograms and counters, per route, in Prometheus text format
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import threading
+import time
+
+
+timer = getattr(time, 'perf_counter', time.time)  # py3.3+ has higher resolution
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+
+METRIC_HELP = {
+    'sqlshite_request_duration_seconds': ('histogram', 'Request latency, until response completely sent'),
+    'sqlshite_sql_execute_seconds': ('histogram', 'Time spent in cursor.execute() per request'),
+    'sqlshite_sql_fetch_seconds': ('histogram', 'Time spent fetching rows from cursor per request'),
+    'sqlshite_requests_total': ('counter', 'Number of requests'),
+    'sqlshite_rows_returned_total': ('counter', 'Number of rows fetched from the database'),
+    'sqlshite_response_bytes_total': ('counter', 'Number of response body bytes (before compression)'),
+    'sqlshite_result_cache_hits_total': ('counter', 'Number of row pages served from the result cache'),
+    'sqlshite_result_cache_misses_total': ('counter', 'Number of row pages not in the result cache'),
+}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # NOT cumulative, see prometheus_lines()
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def prometheus_lines(self, name, labels_str):
+        result = []
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            result.append('%s_bucket{%sle="%s"} %d' % (name, labels_str, upper_bound, cumulative))
+        result.append('%s_bucket{%sle="+Inf"} %d' % (name, labels_str, self.count))
+        labels_str = labels_str.rstrip(',')
+        result.append('%s_sum{%s} %r' % (name, labels_str, self.sum))
+        result.append('%s_count{%s} %d' % (name, labels_str, self.count))
+        return result
+
+
+def format_labels(labels):
+    """labels is a tuple of (name, value) pairs, returns string suitable for use inside {}, with trailing comma"""
+    return ''.join('%s="%s",' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels)
+
+
+class Metrics:
+    """Aggregate request metrics. Per request SQL timings are accumulated in a thread local
+    between request_start() and request_end() (both called by the WSGI app) using add().
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}  # (metric name, labels tuple) -> Histogram
+        self.counters = {}  # (metric name, labels tuple) -> number
+        self.request_local = threading.local()
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def increment(self, name, labels, amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def count(self, name, labels, amount=1):
+        """Thread safe increment(), for use outside of request_end(). No-op if not enabled"""
+        if not self.enabled:
+            return
+        self.lock.acquire()
+        try:
+            self.increment(name, labels, amount)
+        finally:
+            self.lock.release()
+
+    def request_start(self):
+        self.request_local.stats = {
+            'sql_execute_seconds': 0.0,
+            'sql_fetch_seconds': 0.0,
+            'sql_statements': 0,
+            'rows': 0,
+        }
+
+    def add(self, key, value):
+        """Add to current request (thread) stats, e.g. add('rows', 100). No-op outside of a request"""
+        stats = getattr(self.request_local, 'stats', None)
+        if stats is not None:
+            stats[key] += value
+
+    def request_end(self, route, status, duration, bytes_sent):
+        stats = getattr(self.request_local, 'stats', None)
+        self.request_local.stats = None
+        route_labels = (('route', route),)
+        self.lock.acquire()
+        try:
+            self.observe('sqlshite_request_duration_seconds', route_labels, duration)
+            self.increment('sqlshite_requests_total', (('route', route), ('status', status.split(' ', 1)[0])))
+            self.increment('sqlshite_response_bytes_total', route_labels, bytes_sent)
+            if stats and stats['sql_statements']:
+                self.observe('sqlshite_sql_execute_seconds', route_labels, stats['sql_execute_seconds'])
+                self.observe('sqlshite_sql_fetch_seconds', route_labels, stats['sql_fetch_seconds'])
+                self.increment('sqlshite_rows_returned_total', route_labels, stats['rows'])
+        finally:
+            self.lock.release()
+
+    def prometheus_text(self):
+        """Returns metrics in Prometheus text exposition format (string)"""
+        result = []
+        self.lock.acquire()
+        try:
+            for name in sorted(METRIC_HELP):
+                metric_type, help_str = METRIC_HELP[name]
+                result.append('# HELP %s %s' % (name, help_str))
+                result.append('# TYPE %s %s' % (name, metric_type))
+                if metric_type == 'histogram':
+                    for (metric_name, labels), histogram in sorted(self.histograms.items()):
+                        if metric_name == name:
+                            result.extend(histogram.prometheus_lines(name, format_labels(labels)))
+                else:
+                    for (metric_name, labels), value in sorted(self.counters.items()):
+                        if metric_name == name:
+                            result.append('%s{%s} %d' % (name, format_labels(labels).rstrip(','), value))
+        finally:
+            self.lock.release()
+        result.append('')
+        return '\n'.join(result)
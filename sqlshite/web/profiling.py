@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+"""On demand, per request, profiling; cProfile and optionally tracemalloc.
+Results are kept in memory (most recent N) and served by the WSGI app under /_profile/<id>
+"""
+
+import cProfile
+import pstats
+import threading
+import time
+
+try:
+    # py3
+    from io import StringIO
+except ImportError:
+    # py2
+    from StringIO import StringIO
+
+try:
+    import tracemalloc  # py3.4+
+except ImportError:
+    tracemalloc = None
+
+
+DEFAULT_PROFILE_KEEP = 20  # number of profile results kept
+DEFAULT_PROFILE_LINES = 40  # number of pstats/tracemalloc lines in report
+
+
+class RequestProfile:
+    """Profile of a single request, start() and stop() must be called from the same thread
+    """
+    def __init__(self, profile_id, description, memory=False):
+        self.profile_id = profile_id
+        self.description = description
+        self.memory = memory and tracemalloc is not None
+        self.profiler = cProfile.Profile()
+        self.started_tracemalloc = False
+        self.snapshot = None
+        self.memory_stats = None
+        self.duration = None
+        self.created = time.time()
+
+    def start(self):
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracemalloc = True
+            self.snapshot = tracemalloc.take_snapshot()
+        self.start_time = time.time()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.duration = time.time() - self.start_time
+        if self.memory:
+            end_snapshot = tracemalloc.take_snapshot()
+            self.memory_stats = end_snapshot.compare_to(self.snapshot, 'lineno')
+            self.snapshot = None
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+
+    def report(self, sort_by='cumulative', lines=DEFAULT_PROFILE_LINES):
+        """Returns text report, pstats and (if requested) allocation differences"""
+        result = ['profile %s: %s' % (self.profile_id, self.description)]
+        result.append('created %s, duration %.6f seconds' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.created)), self.duration or 0.0))
+        result.append('')
+        stream = StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.strip_dirs().sort_stats(sort_by).print_stats(lines)
+        result.append(stream.getvalue())
+        if self.memory_stats is not None:
+            result.append('tracemalloc, top %d allocation differences by line:' % lines)
+            for stat in self.memory_stats[:lines]:
+                result.append(str(stat))
+        return '\n'.join(result)
+
+
+class Profiler:
+    """Creates and keeps RequestProfile results.
+    Only one request is profiled at a time (profilers are process wide on newer Pythons).
+    """
+    def __init__(self, enabled=False, keep=DEFAULT_PROFILE_KEEP):
+        self.enabled = enabled
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.active = False
+        self.counter = 0
+        self.profiles = {}  # profile_id -> RequestProfile
+        self.profile_ids = []  # oldest first
+
+    def start(self, description, memory=False):
+        """Returns started RequestProfile, or None if another request is currently being profiled"""
+        self.lock.acquire()
+        try:
+            if self.active:
+                return None
+            self.active = True
+            self.counter += 1
+            profile_id = '%d' % self.counter
+        finally:
+            self.lock.release()
+        request_profile = RequestProfile(profile_id, description, memory=memory)
+        request_profile.start()
+        return request_profile
+
+    def stop(self, request_profile):
+        try:
+            request_profile.stop()
+        finally:
+            self.lock.acquire()
+            try:
+                self.active = False
+                self.profiles[request_profile.profile_id] = request_profile
+                self.profile_ids.append(request_profile.profile_id)
+                while len(self.profile_ids) > self.keep:
+                    del self.profiles[self.profile_ids.pop(0)]
+            finally:
+                self.lock.release()
+
+    def get(self, profile_id):
+        return self.profiles.get(profile_id)
+
+    def index_text(self):
+        """Returns text list of kept profiles, most recent first"""
+        result = []
+        for profile_id in reversed(self.profile_ids[:]):
+            request_profile = self.profiles.get(profile_id)
+            if request_profile:
+                result.append('/_profile/%s %.6f %s' % (profile_id, request_profile.duration or 0.0, request_profile.description))
+        result.append('')
+        return '\n'.join(result)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+"""Bounded LRU cache of rendered query results (response bodies), invalidated on any database change.
+Changes are detected with PRAGMA data_version (commits by other connections/processes) and
+connection.total_changes (changes made by the connection itself), see ChangeTracker.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+DEFAULT_RESULT_CACHE_ENTRIES = 256
+DEFAULT_RESULT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+
+class ChangeTracker:
+    """Per database generation number, incremented whenever a change is seen on any connection.
+    instance is unique per process, so (instance, generation) can be used in ETags.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.seen = {}  # id(connection) -> (data_version, total_changes)
+        self.instance = '%x.%x' % (os.getpid(), int(time.time() * 1000))
+
+    def check_changes(self, db):
+        """Check current thread's connection for database changes, returns current generation
+        db is a sqlshite.DatabaseWrapper
+        """
+        connection = db.connection
+        token = (db.data_version(), connection.total_changes)
+        key = id(connection)
+        self.lock.acquire()
+        try:
+            if self.seen.get(key) != token:
+                # changed, or first time this connection is seen (so no baseline to compare with)
+                self.generation += 1
+                self.seen[key] = token
+            return self.generation
+        finally:
+            self.lock.release()
+
+    def bump(self):
+        """Explicitly record a change, e.g. schema change which total_changes does not count"""
+        self.lock.acquire()
+        try:
+            self.generation += 1
+        finally:
+            self.lock.release()
+
+
+class ResultCache:
+    """Entries are tagged with the ChangeTracker generation number, any change seen on any connection bumps the
+    generation so all older entries become stale (removed on lookup or evicted as LRU).
+    """
+    def __init__(self, change_tracker, max_entries=DEFAULT_RESULT_CACHE_ENTRIES, max_bytes=DEFAULT_RESULT_CACHE_MAX_BYTES):
+        self.change_tracker = change_tracker
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (generation, body bytes), least recently used first
+        self.size = 0  # bytes
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        """Explicitly expire all entries, e.g. after user SQL that may have changed the schema"""
+        self.change_tracker.bump()
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.size = 0
+        finally:
+            self.lock.release()
+
+    def get(self, key, generation):
+        """Returns cached body (bytes) or None"""
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] != generation:
+                if entry is not None:
+                    self.size -= len(entry[1])
+                self.misses += 1
+                return None
+            self.entries[key] = entry  # most recently used
+            self.hits += 1
+            return entry[1]
+        finally:
+            self.lock.release()
+
+    def put(self, key, generation, body):
+        if len(body) > self.max_bytes:
+            return
+        self.lock.acquire()
+        try:
+            if generation != self.change_tracker.generation:
+                return  # database changed while result was being generated
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= len(old_entry[1])
+            self.entries[key] = (generation, body)
+            self.size += len(body)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                old_key, old_entry = self.entries.popitem(last=False)
+                self.size -= len(old_entry[1])
+        finally:
+            self.lock.release()
@@ -5,11 +5,20 @@
 """wsgi based Web UI
 """
 
+from collections import OrderedDict
+import binascii
 import copy
+import csv
+from datetime import date, datetime
+from email.utils import parsedate_tz, mktime_tz
+import gzip
+import hashlib
+import io
 import json
 import logging
 import os
 import sys
+import threading
 
 
 try:
@@ -21,21 +30,30 @@ except ImportError:
 
 try:
     # py3
-    from urllib.parse import parse_qs
+    from urllib.parse import parse_qs, quote, urlencode
 except ImportError:
     # py2 (and <py3.8)
     from cgi import parse_qs
+    from urllib import quote, urlencode
 
 import mimetypes
 from pprint import pprint
 
 import socket
+import sqlite3
 import struct
 import sys
 import time
+import zlib
 
 
-from wsgiref.simple_server import make_server
+from wsgiref.simple_server import make_server, WSGIServer
+
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # py2
+    from SocketServer import ThreadingMixIn
 
 try:
     import bjoern
@@ -44,6 +62,7 @@ except ImportError:
 
 try:
     import cheroot  # CherryPy Server https://cheroot.cherrypy.dev/en/latest/pkg/cheroot.wsgi/
+    import cheroot.wsgi
 except ImportError:
     cheroot = None
 
@@ -55,6 +74,10 @@ except ImportError:
 import stache
 
 import sqlshite
+from sqlshite.importer import TableImporter, coerce_function, import_csv, import_ndjson, iter_text_lines, DEFAULT_IMPORT_BATCH_SIZE
+from sqlshite.web.metrics import Metrics, timer
+from sqlshite.web.profiling import Profiler
+from sqlshite.web.result_cache import ChangeTracker, ResultCache, DEFAULT_RESULT_CACHE_ENTRIES, DEFAULT_RESULT_CACHE_MAX_BYTES
 
 is_jy = hasattr(sys, 'JYTHON_JAR') or str(copyright).find('Jython') > 0
 
@@ -76,6 +99,26 @@ except NameError:
     unicode = str
 
 DEFAULT_SERVER_PORT = 8777
+DEFAULT_ROW_BATCH_SIZE = 500  # rows per cursor.fetchmany() when streaming, override with "row_batch_size" in config
+DEFAULT_PAGE_SIZE = 100  # rows per page, override with "page_size" in config
+MAX_PAGE_SIZE = 1000  # upper limit for ?limit=N
+DEFAULT_SLOW_QUERY_MS = 500  # log queries taking longer than this, override with "slow_query_ms" in config, 0 disables
+BLOB_SIGNATURES = (  # (leading bytes, content type) used to guess blob content type
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'SQLite format 3\x00', 'application/vnd.sqlite3'),
+)
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+DEFAULT_PREVIEW_LENGTH = 200  # characters of long text values shown in row listings, override with "preview_length" in config
+VM_STEP_INTERVAL = 1000  # SQLite virtual machine instructions between progress handler calls, for SQL editor query stats
 
 def serve_file(path, content_type=None):
     """returns file type and file object, assumes file exists (and readable), returns [] for file on read error"""
@@ -108,6 +151,35 @@ def not_found_404(environ, start_response):
 </body></html>''')]
 
 
+def metrics(environ, start_response):
+    """Prometheus text format metrics, see sqlshite.web.metrics"""
+    if not global_metrics.enabled:
+        return not_found_404(environ, start_response)
+    body = to_bytes(global_metrics.prometheus_text())
+    start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'), ('Content-Length', str(len(body))), ('Cache-Control', 'no-cache')])
+    return [body]
+
+def etag_matches(environ, etag):
+    """Check request If-None-Match header against etag (weak comparison, as per RFC 9110)
+    """
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag.replace('W/', '', 1)
+    for request_etag in if_none_match.split(','):
+        if request_etag.strip().replace('W/', '', 1) == etag:
+            return True
+    return False
+
+def not_modified_304(environ, start_response, headers=None):
+    """serves 304s, headers should include ETag (and/or Last-Modified) as per 200 response."""
+    headers = [x for x in headers or [] if x[0].lower() not in ('content-type', 'content-length')]
+    start_response('304 Not Modified', headers)
+    return []
+
+
 # Weekday and month names for HTTP date/time formatting; always English!
 _weekdayname = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
 _monthname = [None, # Dummy so we can use 1-based month numbers
@@ -123,6 +195,147 @@ def header_format_date_time(timestamp):
 def current_timestamp_for_header():
     return header_format_date_time(time.time())
 
+def accepts_gzip(environ):
+    """Check request Accept-Encoding header for gzip (that has not been refused with q=0)
+    """
+    for encoding in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        encoding = encoding.strip().split(';')
+        if encoding[0].strip().lower() in ('gzip', 'x-gzip'):
+            for parameter in encoding[1:]:
+                parameter = parameter.replace(' ', '')
+                if parameter.startswith('q=') and float(parameter[2:] or 0) == 0:
+                    return False
+            return True
+    return False
+
+def gzip_bytes(data, compresslevel=9):
+    """Returns gzip compressed version of data bytes"""
+    f = io.BytesIO()
+    gz = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=compresslevel, mtime=0)
+    gz.write(data)
+    gz.close()
+    return f.getvalue()
+
+STATIC_MAX_CACHE_SIZE = 1024 * 1024  # files larger than this are streamed from disk rather than held in memory
+STATIC_MIN_GZIP_SIZE = 1024  # do not bother compressing small files
+
+class StaticFiles:
+    """Static files from a directory (www), loaded into memory at startup (see load_all()).
+    Serves real Last-Modified and ETag, answers If-None-Match/If-Modified-Since with 304,
+    and serves pre-compressed gzip versions of text files when the client accepts gzip.
+    If reload is set (dev mode, "static_reload" config) file modification time is checked
+    on each request, otherwise only files present at startup are served.
+    """
+    compressible_content_types = ('application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+    def __init__(self, host_dir, reload=False, max_cache_size=STATIC_MAX_CACHE_SIZE):
+        self.host_dir = os.path.abspath(host_dir)
+        self.reload = reload
+        self.max_cache_size = max_cache_size
+        self.files = {}  # path_info, e.g. '/js/jquery.min.js' -> dictionary
+
+    def load_all(self):
+        for dirpath, dirnames, filenames in os.walk(self.host_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                path_info = '/' + os.path.relpath(path, self.host_dir).replace(os.sep, '/')
+                self.load(path_info, path)
+        log.info('loaded %d static files', len(self.files))
+
+    def load(self, path_info, path):
+        mtime = os.path.getmtime(path)
+        size = os.path.getsize(path)
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        static_file = {
+            'path': path,
+            'mtime': mtime,
+            'content_type': content_type,
+            'size': size,
+            'last_modified': header_format_date_time(mtime),
+            'body': None,
+            'gzip_body': None,
+        }
+        if size <= self.max_cache_size:
+            f = open(path, 'rb')
+            body = f.read()
+            f.close()
+            static_file['body'] = body
+            static_file['etag'] = '"%s"' % hashlib.sha1(body).hexdigest()
+            if size >= STATIC_MIN_GZIP_SIZE and (content_type.startswith('text/') or content_type in self.compressible_content_types):
+                gzip_body = gzip_bytes(body)
+                if len(gzip_body) < size:
+                    static_file['gzip_body'] = gzip_body
+        else:
+            static_file['etag'] = '"%x-%x"' % (int(mtime), size)
+        self.files[path_info] = static_file
+        return static_file
+
+    def lookup(self, path_info):
+        """Returns static file dictionary for path_info or None if not a static file
+        """
+        static_file = self.files.get(path_info)
+        if not self.reload:
+            return static_file
+        path = os.path.abspath(os.path.join(self.host_dir, path_info.lstrip('/')))
+        if not path.startswith(self.host_dir + os.sep) or not os.path.isfile(path):
+            self.files.pop(path_info, None)
+            return None
+        if static_file is None or static_file['mtime'] != os.path.getmtime(path):
+            static_file = self.load(path_info, path)
+        return static_file
+
+    def serve(self, environ, start_response, static_file):
+        use_gzip = static_file['gzip_body'] is not None and accepts_gzip(environ)
+        etag = static_file['etag']
+        if use_gzip:
+            etag = etag[:-1] + '-gzip"'  # different representation, different (strong) etag
+        headers = [
+            ('Content-type', static_file['content_type']),
+            ('Last-Modified', static_file['last_modified']),
+            ('ETag', etag),
+        ]
+        if static_file['gzip_body'] is not None:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if etag_matches(environ, etag) or (not environ.get('HTTP_IF_NONE_MATCH') and not_modified_since(environ, static_file['mtime'])):
+            return not_modified_304(environ, start_response, headers)
+
+        if static_file['body'] is None:
+            # large file, stream from disk
+            headers.append(('Content-Length', str(static_file['size'])))
+            start_response('200 OK', headers)
+            f = open(static_file['path'], 'rb')
+            if 'wsgi.file_wrapper' in environ:
+                return environ['wsgi.file_wrapper'](f, 64 * 1024)  # may use sendfile()
+            return file_chunks(f, 64 * 1024)
+        body = static_file['body']
+        if use_gzip:
+            body = static_file['gzip_body']
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Content-Length', str(len(body))))
+        start_response('200 OK', headers)
+        return [body]
+
+def file_chunks(f, chunk_size):
+    """Generator, read file object in chunks, closes file when done"""
+    try:
+        data = f.read(chunk_size)
+        while data:
+            yield data
+            data = f.read(chunk_size)
+    finally:
+        f.close()
+
+def not_modified_since(environ, mtime):
+    """Check request If-Modified-Since header against (file) modification time
+    """
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if not if_modified_since:
+        return False
+    date_tuple = parsedate_tz(if_modified_since)
+    if date_tuple is None:
+        return False
+    return int(mtime) <= mktime_tz(date_tuple)
+
 
 def determine_local_ipaddr():
     local_address = None
@@ -198,43 +411,312 @@ def my_start_server(callable_app):
         bjoern.run(simple_app, '', server_port)  # FIXME use local_ip?
     elif cheroot:
         # Untested
-        server = cheroot.wsgi.Server(('0.0.0.0', server_port), my_crazy_app)  # '' untested for address
+        log.info('Using: cheroot')
+        server = cheroot.wsgi.Server(('0.0.0.0', server_port), simple_app)  # '' untested for address
         server.start()
     elif meinheld:
         # Untested, Segmentation fault when serving a file :-(
         meinheld.server.listen(('0.0.0.0', server_port))  # does not accept ''
         meinheld.server.run(simple_app)
     else:
-        log.info('Using: wsgiref.simple_server')
-        httpd = make_server('', server_port, simple_app)  # FIXME use local_ip?
+        if global_config.get('threaded'):
+            log.info('Using: wsgiref.simple_server (threaded)')
+            httpd = make_server('', server_port, simple_app, server_class=ThreadingWSGIServer)  # FIXME use local_ip?
+        else:
+            log.info('Using: wsgiref.simple_server')
+            httpd = make_server('', server_port, simple_app)  # FIXME use local_ip?
         httpd.serve_forever()
 
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """wsgiref server with a thread per request, use with "pool_size" config so each thread has its own connection"""
+    daemon_threads = True
+
 
 host_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'www')
+static_files = StaticFiles(host_dir)
 template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 
-render_template_cache = {}
-def render_template(template_filename, variables, use_cache=False):
+class TemplateCache:
+    """Cache of parsed (tokenized) stache templates from template_dir, so rendering does no file I/O or parsing.
+    If reload is set (dev mode, "template_reload" config) file modification time is checked on each
+    use and the template re-parsed when it changes.
+    """
+    def __init__(self, template_dir, reload=False):
+        self.template_dir = template_dir
+        self.reload = reload
+        self.sources = {}  # template filename -> template (unicode) string
+        self.mtimes = {}  # template filename -> file modification time when loaded
+        self.parts = {}  # (template filename, section name) -> (head name, section string, tail name)
+        self.part_names = set()
+        if hasattr(stache, 'Stache'):
+            self.engine = stache.Stache()  # holds the parsed templates
+        else:
+            self.engine = None  # stache without template support, cache source only
+
+    def load(self, template_filename):
+        """Load (or reload if changed) template, returns template string
+        """
+        if template_filename in self.sources and not self.reload:
+            return self.sources[template_filename]
+        path = os.path.join(self.template_dir, template_filename)
+        mtime = os.path.getmtime(path)
+        if template_filename in self.sources and self.mtimes[template_filename] == mtime:
+            return self.sources[template_filename]
+        log.debug('loading template %r', template_filename)
+        f = open(path, 'rb')
+        template_string = f.read().decode('utf-8')
+        f.close()
+        if self.engine:
+            self.engine.add_template(template_filename, template_string)
+        for key in list(self.parts):
+            if key[0] == template_filename:
+                del self.parts[key]
+        self.sources[template_filename] = template_string
+        self.mtimes[template_filename] = mtime
+        return template_string
+
+    def warm(self):
+        """Pre-load all templates in template_dir"""
+        for template_filename in os.listdir(self.template_dir):
+            if template_filename.endswith('.html'):
+                self.load(template_filename)
+
+    def render(self, template_name, variables):
+        """Returns (unicode) string, where template_name is a filename or a part name from split()
+        """
+        if template_name not in self.part_names:
+            self.load(template_name)
+        if self.engine:
+            return self.engine.render_template(template_name, variables)
+        return stache.render(self.sources[template_name], variables)
+
+    def split(self, template_filename, section_name):
+        """Split template into head, section, and tail around {{#section_name}}...{{/section_name}}
+        for streaming, i.e. render head, stream section once per item, then render tail.
+        Returns (head name, section string, tail name), names are for use with render()
+        """
+        template_string = self.load(template_filename)
+        key = (template_filename, section_name)
+        parts = self.parts.get(key)
+        if parts is None:
+            head, section, tail = split_template(template_string, section_name)
+            head_name = '%s#%s#head' % key
+            tail_name = '%s#%s#tail' % key
+            for name, part_string in ((head_name, head), (tail_name, tail)):
+                self.sources[name] = part_string
+                if self.engine:
+                    self.engine.add_template(name, part_string)
+            self.part_names.update((head_name, tail_name))
+            parts = (head_name, section, tail_name)
+            self.parts[key] = parts
+        return parts
+
+template_cache = TemplateCache(template_dir)
+
+def render_template(template_filename, variables, use_cache=True):
     """Where use_cache means both lookup and store in cache
     Returns bytes
     """
-    template_filename = os.path.join(template_dir, template_filename)
     if use_cache:
-        template_string = render_template_cache.get(template_filename)
-    else:
-        template_string = None
-
-    if not template_string:
-        f = open(template_filename, 'rb')
-        template_string = f.read().decode('utf-8')
-        f.close()
-        if use_cache:
-            render_template_cache[template_filename] = template_string
-
+        return template_cache.render(template_filename, variables).encode('utf-8')
+    f = open(os.path.join(template_dir, template_filename), 'rb')
+    template_string = f.read().decode('utf-8')
+    f.close()
     return stache.render(template_string, variables).encode('utf-8')
 
+def split_template(template_string, section_name):
+    """Split template string into (head, section, tail) strings around {{#section_name}}...{{/section_name}}
+    for streaming, i.e. render head, stream section once per item, then render tail
+    """
+    head, rest = template_string.split('{{#%s}}' % section_name, 1)
+    section, tail = rest.split('{{/%s}}' % section_name, 1)
+    return head, section, tail
+
 global_config = {}
 global_dbs = {}
+global_metrics = Metrics()
+global_profiler = Profiler()
+global_result_caches = {}  # database name -> ResultCache
+global_change_trackers = {}  # database name -> ChangeTracker
+global_result_caches_lock = threading.Lock()
+
+def execute_sql(cursor, sql, bind_parameters=None, dal=None):
+    """cursor.execute() with timing recorded for metrics, returns cursor
+    If dal is set, also check for slow query (use when result is fetched immediately, else see QueryStats),
+    explained on the cursor's connection so safe within write() functions (write queue thread)
+    """
+    start_time = timer()
+    if bind_parameters:
+        cursor.execute(sql, bind_parameters)
+    else:
+        cursor.execute(sql)
+    duration = timer() - start_time
+    global_metrics.add('sql_execute_seconds', duration)
+    global_metrics.add('sql_statements', 1)
+    if dal is not None:
+        slow_query_check(dal, sql, bind_parameters, duration, connection=cursor.connection)
+    return cursor
+
+def slow_query_check(dal, sql, bind_parameters, duration, row_count=None, connection=None):
+    """Log query (with query plan) if duration (seconds) is over the slow_query_ms threshold
+    connection is used for the query plan, see DatabaseWrapper.explain_query_plan()
+    """
+    slow_query_ms = dal_setting(dal, 'slow_query_ms', DEFAULT_SLOW_QUERY_MS)
+    if not slow_query_ms or duration * 1000 < slow_query_ms:
+        return
+    try:
+        plan = dal.db.explain_query_plan(sql, bind_parameters, connection=connection)
+    except dal.db.driver.Error as info:
+        plan = [(0, 0, 'EXPLAIN QUERY PLAN failed %r' % info)]
+    full_scans = sqlshite.query_plan_full_scans(plan)
+    log.warning('slow query %.3f seconds, %s rows, database %s%s: %s params %r\n%s',
+        duration,
+        '?' if row_count is None else row_count,
+        dal.name,
+        ' FULL SCAN (%s)' % ', '.join(full_scans) if full_scans else '',
+        sql,
+        bind_parameters,
+        '\n'.join(sqlshite.query_plan_lines(plan))
+    )
+
+class QueryStats:
+    """Wall time of a query, including fetching all rows, for slow query log.
+    With explain=True (SQL editor) also collects EXPLAIN QUERY PLAN and an approximate count of
+    SQLite virtual machine steps (sqlite3 module does not expose sqlite3_stmt_status() scan counters)
+    for display with html().
+    """
+    def __init__(self, dal, sql, bind_parameters=None, explain=False):
+        self.dal = dal
+        self.sql = sql
+        self.bind_parameters = bind_parameters
+        self.explain = explain
+        self.plan = None
+        self.plan_error = None
+        self.vm_steps = 0
+        self.duration = None
+        self.row_count = None
+        self.connection = None
+
+    def count_vm_steps(self):
+        self.vm_steps += VM_STEP_INTERVAL
+        return 0  # continue
+
+    def start(self):
+        if self.explain:
+            # before execution, EXPLAIN of DDL will fail once executed
+            try:
+                self.plan = self.dal.db.explain_query_plan(self.sql, self.bind_parameters)
+            except self.dal.db.driver.Error as info:
+                self.plan_error = info
+            self.connection = self.dal.db.connection
+            self.connection.set_progress_handler(self.count_vm_steps, VM_STEP_INTERVAL)
+        self.start_time = timer()
+
+    def finish(self, row_count=None):
+        self.duration = timer() - self.start_time
+        self.row_count = row_count
+        self.stop_counting()
+        slow_query_check(self.dal, self.sql, self.bind_parameters, self.duration, row_count)
+
+    def stop_counting(self):
+        if self.connection is not None:
+            self.connection.set_progress_handler(None, 0)
+            self.connection = None
+
+    def html(self):
+        result = ['<div id="query_stats">\n<h4>Query</h4>\n<pre>%s</pre>\n' % escape_html(self.sql)]
+        result.append('%.6f seconds wall time, %s rows returned, ~%d VM steps<br>\n' % (self.duration or 0.0, self.row_count, self.vm_steps))
+        result.append('<h4>EXPLAIN QUERY PLAN</h4>\n<pre>')
+        if self.plan_error is not None:
+            result.append(escape_html(str(self.plan_error)))
+        for line in sqlshite.query_plan_lines(self.plan or []):
+            if sqlshite.is_full_scan(line.strip()):
+                result.append('<span style="color:red">%s</span>  &lt;-- full table scan\n' % escape_html(line))
+            else:
+                result.append(escape_html(line) + '\n')
+        result.append('</pre>\n</div>\n')
+        return ''.join(result)
+
+def fetchmany_timed(cursor, size):
+    """cursor.fetchmany() with timing and row count recorded for metrics
+    """
+    start_time = timer()
+    rows = cursor.fetchmany(size)
+    global_metrics.add('sql_fetch_seconds', timer() - start_time)
+    global_metrics.add('rows', len(rows))
+    return rows
+
+def fetchone_timed(cursor):
+    """cursor.fetchone() with timing and row count recorded for metrics
+    """
+    start_time = timer()
+    row = cursor.fetchone()
+    global_metrics.add('sql_fetch_seconds', timer() - start_time)
+    if row is not None:
+        global_metrics.add('rows', 1)
+    return row
+
+def dal_setting(dal, key, default=None):
+    """Lookup setting for a database, per database config first then global config
+    """
+    return dal.config.get(key, global_config.get(key, default))
+
+def get_dal(database_name):
+    """Lookup DataAccessLayer by database name (None if not found),
+    checking for schema changes unless "schema_check" setting is false
+    """
+    dal = global_dbs.get(database_name)
+    if dal and dal_setting(dal, 'schema_check', True):
+        dal.refresh_schema()
+    return dal
+
+def release_database_connections():
+    """Return any pooled connections used by the current thread and commit pending changes, see sqlshite.DatabaseWrapper.release()
+    """
+    for dal in global_dbs.values():
+        dal.db.release()
+
+class ReleaseConnectionsIterable:
+    """Wrap a WSGI response iterable, releasing (per-thread) pooled database connections
+    when the server calls close(), i.e. after a streamed response has been completely sent.
+    Also records request metrics (if metrics_info is set) at that point, so latency includes streaming.
+    metrics_info is a dict with environ, start_time, and status (filled in by start_response wrapper).
+    Similarly stops the request profiler (if request_profile is set).
+    """
+    def __init__(self, result, metrics_info=None, request_profile=None):
+        self.result = result
+        self.metrics_info = metrics_info
+        self.request_profile = request_profile
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        if self.metrics_info is None:
+            return iter(self.result)
+        return self.counting_iter()
+
+    def counting_iter(self):
+        for chunk in self.result:
+            self.bytes_sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            release_database_connections()
+            if self.request_profile is not None:
+                global_profiler.stop(self.request_profile)
+                self.request_profile = None
+            metrics_info = self.metrics_info
+            if metrics_info is not None:
+                self.metrics_info = None  # only record once
+                global_metrics.request_end(
+                    metrics_info['environ'].get('sqlshite.route', 'other'),
+                    metrics_info['status'] or '500',
+                    timer() - metrics_info['start_time'],
+                    self.bytes_sent
+                )
 
 def list_databases(environ, start_response):
     status = '200 OK'
@@ -257,7 +739,7 @@ def list_tables(environ, start_response):
     path_info_list = [x for x in path_info.split('/') if x]
     #current_path = '/'.join(path_info_list)  # TODO current full URL
     database = path_info_list[1]
-    dal = global_dbs.get(database)
+    dal = get_dal(database)
     if not dal:
         return not_found_404(environ, start_response)
     result.append(render_template('list_tables.html', {'database_name': dal.name, 'tables': [table_name for table_name in dal.schema]}))
@@ -278,13 +760,18 @@ def jsonform(environ, start_response):
     #current_path = '/'.join(path_info_list)  # TODO current full URL
     database = path_info_list[1]
     table_name = path_info_list[2]
-    dal = global_dbs.get(database)
+    dal = get_dal(database)
     if not dal:
         return not_found_404(environ, start_response)
-    jsonform_dict = dal.jsonform.get(table_name)
-    if not jsonform_dict:
+    json_bytes, etag = dal.get_jsonform_json(table_name)  # pre-serialized
+    if not json_bytes:
         return not_found_404(environ, start_response)
-    result.append(json.dumps(jsonform_dict, indent=4, default=str).encode('utf-8'))
+    headers.append(('ETag', etag))
+    headers.append(('Cache-Control', 'no-cache'))  # always revalidate, schema may change
+    if etag_matches(environ, etag):
+        return not_modified_304(environ, start_response, headers)
+    headers.append(('Content-Length', str(len(json_bytes))))
+    result.append(json_bytes)
     start_response(status, headers)
     return result
 
@@ -299,27 +786,140 @@ def view_row(environ, start_response, dal, table_name, schema, rowid):
     headers = [('Content-type', 'text/html')]
     result = []
 
-    jsonform_dict = dal.jsonform.get(table_name)
-    if not jsonform_dict:
+    json_bytes, etag = dal.get_jsonform_json(table_name)  # pre-serialized
+    if not json_bytes:
         return not_found_404(environ, start_response)
 
     sql = 'select * from "%s" where rowid=?' % table_name  # Assume table really exists from previous caller sanity checks
     cursor = dal.db.cursor
-    cursor.execute(sql, (rowid,))
+    execute_sql(cursor, sql, (rowid,), dal=dal)
     column_names = list(x[0] for x in cursor.description)  # or use schema... has more detail (at least for SQLite)
-    row = cursor.fetchone()
+    row = fetchone_timed(cursor)
     if not row:
         return not_found_404(environ, start_response)
     row_dict = dict(zip(column_names, row))
-    jsonform = copy.copy(jsonform_dict)
-    jsonform['value'] = row_dict
     # FIXME this assumes, and deletes the buttons from the form
     #del(jsonform["form"][-1])  # FIXME
 
-    result.append(json.dumps(jsonform, indent=4, default=str).encode('utf-8'))
+    # splice value into cached schema json rather than serializing the schema again, i.e. jsonform['value'] = row_dict
+    result.append(json_bytes[:-1])  # without closing }
+    result.append(b',"value":')
+    result.append(json.dumps(row_dict, separators=(',', ':'), default=str).encode('utf-8'))
+    result.append(b'}')
     start_response(status, headers)
     return result
 
+def column_value(environ, start_response, dal, table_name, schema, rowid, column_name):
+    """Full value of a single column, i.e. the link from a truncated preview in row listings.
+    Text is served as text/plain, blobs as application/octet-stream
+    """
+    if column_name not in [x[0] for x in schema]:
+        return not_found_404(environ, start_response)
+    sql = 'select %s from "%s" where rowid=?' % (sqlshite.quote_identifier(column_name), table_name)
+    cursor = dal.db.cursor
+    execute_sql(cursor, sql, (rowid,), dal=dal)
+    row = fetchone_timed(cursor)
+    if not row:
+        return not_found_404(environ, start_response)
+    value = row[0]
+    if isinstance(value, (bytes, bytearray)) and not isinstance(value, str):
+        content_type = 'application/octet-stream'
+        body = bytes(value)
+    else:
+        content_type = 'text/plain; charset=utf-8'
+        body = (u'' if value is None else unicode(value)).encode('utf-8')
+    start_response('200 OK', [('Content-type', content_type), ('Content-Length', str(len(body)))])
+    return [body]
+
+def guess_blob_content_type(value_type, leading_bytes):
+    """Content type from SQLite typeof() and the first few bytes of the value"""
+    if value_type == 'text':
+        return 'text/plain; charset=utf-8'
+    for signature, content_type in BLOB_SIGNATURES:
+        if leading_bytes.startswith(signature):
+            return content_type
+    if leading_bytes.startswith(b'RIFF') and leading_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+def byte_range(environ, size, etag):
+    """Returns (offset, length) for a single range Range request header (RFC 9110), or None for a
+    full response; no Range header, multiple ranges (not supported) or If-Range does not match etag.
+    Raises ValueError if the range is not satisfiable
+    """
+    range_header = environ.get('HTTP_RANGE')
+    if not range_header:
+        return None
+    if_range = environ.get('HTTP_IF_RANGE')
+    if if_range and if_range.strip() != etag:
+        return None  # client copy is out of date, send it all
+    units, _, range_spec = range_header.partition('=')
+    if units.strip().lower() != 'bytes' or ',' in range_spec:
+        return None
+    first, _, last = range_spec.strip().partition('-')
+    try:
+        if first:
+            offset = int(first)
+            end = int(last) if last else size - 1
+        else:
+            suffix_length = int(last)  # last N bytes
+            if suffix_length <= 0:
+                raise ValueError('empty suffix range')
+            offset = max(0, size - suffix_length)
+            end = size - 1
+    except ValueError:
+        if first or last.strip():
+            raise
+        return None  # "bytes=-", ignore
+    if offset < 0 or offset >= size or end < offset:
+        raise ValueError('range not satisfiable %r for size %d' % (range_header, size))
+    return offset, min(end, size - 1) - offset + 1
+
+def blob_value(environ, start_response, dal, table_name, schema, rowid, column_name):
+    """Stream a column value (incremental BLOB I/O, see DatabaseWrapper.blob_chunks()) in fixed size chunks,
+    constant memory no matter how large the value. Supports (single) Range requests, e.g. for media players
+    and resumed downloads. Content type is guessed from the leading bytes.
+    """
+    if column_name not in [x[0] for x in schema]:
+        return not_found_404(environ, start_response)
+    column_name_q = sqlshite.quote_identifier(column_name)
+    sql = 'select typeof(%s), length(CAST(%s AS BLOB)), substr(CAST(%s AS BLOB), 1, 16) from "%s" where rowid=?' % (column_name_q, column_name_q, column_name_q, table_name)
+    cursor = dal.db.cursor
+    execute_sql(cursor, sql, (rowid,), dal=dal)
+    row = fetchone_timed(cursor)
+    if not row or row[0] == 'null':
+        return not_found_404(environ, start_response)
+    value_type, size, leading_bytes = row
+    if value_type not in ('blob', 'text'):
+        return column_value(environ, start_response, dal, table_name, schema, rowid, column_name)  # numbers, nothing to stream
+    etag = data_etag(environ, dal, 'blob', table_name, rowid, column_name)
+    headers = [
+        ('Content-type', guess_blob_content_type(value_type, bytes(leading_bytes or b''))),
+        ('ETag', etag),
+        ('Cache-Control', 'no-cache'),
+        ('Accept-Ranges', 'bytes'),
+    ]
+    if etag_matches(environ, etag):
+        return not_modified_304(environ, start_response, headers)
+    try:
+        requested_range = byte_range(environ, size, etag)
+    except ValueError:
+        start_response('416 Range Not Satisfiable', [('Content-Range', 'bytes */%d' % size), ('Content-Length', '0')])
+        return []
+    if requested_range is None:
+        status = '200 OK'
+        offset, length = 0, size
+    else:
+        status = '206 Partial Content'
+        offset, length = requested_range
+        headers.append(('Content-Range', 'bytes %d-%d/%d' % (offset, offset + length - 1, size)))
+    headers.append(('Content-Length', str(length)))
+    start_response(status, headers)
+    if environ['REQUEST_METHOD'] == 'HEAD' or not length:
+        return []
+    chunk_size = dal_setting(dal, 'blob_chunk_size', sqlshite.DEFAULT_BLOB_CHUNK_SIZE)
+    return dal.db.blob_chunks(table_name, column_name, rowid, offset, length, chunk_size=chunk_size)
+
 def view_html(environ, start_response, dal, table_name, schema, rowid, request_body=None):
     """View a row, NOTE duplication of code with add and edit
     FIXME redirect if not ending in /
@@ -331,10 +931,16 @@ def view_html(environ, start_response, dal, table_name, schema, rowid, request_b
 
     if request_body:
         #  {b'number=&str=qwertyuiop%5B&float=&date=&datetime=&bottles_of_beer=99&delimited+id='}
-        print('view_html rowid %r request_body %r' % (rowid, request_body,))
-        value_dict = parse_first_values(request_body)
+        log.debug('view_html rowid %r request_body %r', rowid, request_body)
+        value_dict = parse_first_values(request_body, keep_blank_values=True)  # cleared field means NULL (or '' for text)
+        for metadata in schema or dal.schema.get(table_name):
+            if metadata[1] is bool and metadata[0] not in value_dict:
+                value_dict[metadata[0]] = 'false'  # unchecked checkbox is not posted at all
         # Now figure out was this an ADD or EDIT/UPDATE? Assume as VIEW this is EDIT
-        database_result = insert_update_row(dal, table_name, value_dict, schema=schema, update=True, rowid=rowid)
+        database_result = update_changed_columns(dal, table_name, value_dict, rowid, schema=schema)
+        if database_result.get('error'):
+            start_response(database_result['status'], [('Content-type', 'text/plain; charset=utf-8')])
+            return [to_bytes(database_result['error'])]
         rowid = database_result.get('rowid')
         if rowid:
             # redirect....
@@ -343,7 +949,7 @@ def view_html(environ, start_response, dal, table_name, schema, rowid, request_b
             start_response('302 Found', [('Location', '../%s' % unicode(rowid))])
             return [b'redirect to view']
         # TODO handle errors....
-        print('view_html rowid %r database_result %r' % (rowid, database_result,))  # should be rowid, unless rowid/pk was updated...
+        log.debug('view_html rowid %r database_result %r', rowid, database_result)  # should be rowid, unless rowid/pk was updated...
         return return_json(environ, start_response, value_dict)  # DEBUG TODO do something
 
     # TODO use rowid?
@@ -363,6 +969,40 @@ def rescan(environ, start_response, dal):
     start_response(status, headers)
     return result
 
+def index_advisor(environ, start_response, dal, request_body=None):
+    """List columns used for quick search, sort, and paging that are missing an index.
+    POST table_name and column_name to create a missing index, only if allow_create_index is set in config.
+    """
+    status = '200 OK'
+    headers = [('Content-type', 'text/html')]
+    result = []
+
+    allow_create_index = dal_setting(dal, 'allow_create_index', False)
+    if environ['REQUEST_METHOD'] == 'POST':
+        if not allow_create_index:
+            start_response('403 Forbidden', [('Content-type', 'text/plain')])
+            return [b'create index not enabled, set allow_create_index in config']
+        value_dict = parse_first_values(request_body or b'')
+        table_name = value_dict.get('table_name')
+        column_name = value_dict.get('column_name')
+        try:
+            dal.create_index(table_name, column_name)
+        except KeyError:
+            return not_found_404(environ, start_response)
+        start_response('303 See Other', [('Location', './')])
+        return [b'index created']
+
+    advice = dal.index_advice()
+    for entry in advice:
+        entry['allow_create_index'] = allow_create_index
+    result.append(render_template('list_indexes.html', {
+        'database_name': dal.name,
+        'advice': advice,
+        'missing_count': len([x for x in advice if not x['index_name']]),
+    }))
+    start_response(status, headers)
+    return result
+
 def insert_update_row(dal, table_name, user_values_dict, schema=None, update=False, rowid=None):
     """schema required as do not trust column names in user_values_dict
     TODO error handling/reporting
@@ -405,10 +1045,293 @@ def insert_update_row(dal, table_name, user_values_dict, schema=None, update=Fal
         sql = 'INSERT INTO "%s" ("%s") VALUES (%s)' % (table_name, '", "'.join(columns_names_in_statement), bind_markers_str)  # FIXME delimited column names
 
     log.debug('sql: %s' % sql)
-    cursor = dal.db.cursor
-    cursor.execute(sql, tuple(bind_parameters))
+    def write(connection):
+        cursor = connection.cursor()
+        try:
+            execute_sql(cursor, sql, tuple(bind_parameters), dal=dal)
+            return cursor.lastrowid
+        finally:
+            cursor.close()
+    lastrowid = dal.db.write(write)  # committed, see "write_queue" config
     # TODO return pk / lastrowid
-    return {'rowid': row_value_dict.get('rowid', rowid if rowid is not None else cursor.lastrowid)}
+    return {'rowid': row_value_dict.get('rowid', rowid if rowid is not None else lastrowid)}
+
+BULK_VALUE_TYPES = (unicode, str, int, float, type(None))  # json scalars (bool is an int)
+
+def bulk_row_statement(table_name, schema_column_names, row):
+    """Validate a row (dict) for bulk_insert_update_rows(), returns (group key, bind parameters)
+    group key is (sql, operation), rows with the same key can be written with a single executemany().
+    Rows with a "rowid" are updates (of the given columns only), otherwise inserts (None values omitted, DBMS default).
+    Raises ValueError for invalid rows
+    """
+    if not isinstance(row, dict):
+        raise ValueError('row must be an object')
+    rowid = row.get('rowid')
+    column_names = []
+    bind_parameters = []
+    for column_name in sorted(row):
+        if column_name == 'rowid':
+            continue
+        if column_name not in schema_column_names:
+            raise ValueError('unknown column %r' % column_name)
+        value = row[column_name]
+        if not isinstance(value, BULK_VALUE_TYPES):
+            raise ValueError('unsupported value for column %r' % column_name)
+        if value is None and rowid is None:
+            continue
+        column_names.append(column_name)
+        bind_parameters.append(value)
+    table_name_q = sqlshite.quote_identifier(table_name)
+    column_names_q = [sqlshite.quote_identifier(x) for x in column_names]
+    if rowid is not None:
+        if not isinstance(rowid, int) or isinstance(rowid, bool):
+            raise ValueError('rowid must be an integer')
+        if not column_names:
+            raise ValueError('no columns to update')
+        bind_parameters.append(rowid)
+        sql = 'UPDATE %s SET %s WHERE rowid = ?' % (table_name_q, ', '.join('%s = ?' % x for x in column_names_q))
+        return (sql, 'update'), tuple(bind_parameters)
+    if column_names:
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (table_name_q, ', '.join(column_names_q), ', '.join(['?'] * len(column_names)))
+    else:
+        sql = 'INSERT INTO %s DEFAULT VALUES' % table_name_q
+    return (sql, 'insert'), tuple(bind_parameters)
+
+def bulk_write_row(cursor, sql, operation, bind_parameters):
+    """Single row fallback for bulk_insert_update_rows(), returns result dict for row"""
+    cursor.execute('SAVEPOINT sqlshite_bulk_row')
+    try:
+        cursor.execute(sql, bind_parameters)
+        if operation == 'update' and cursor.rowcount == 0:
+            raise ValueError('no such rowid')
+    except (sqlite3.Error, ValueError) as info:
+        cursor.execute('ROLLBACK TO sqlshite_bulk_row')
+        cursor.execute('RELEASE sqlshite_bulk_row')
+        return {'error': str(info)}
+    cursor.execute('RELEASE sqlshite_bulk_row')
+    if operation == 'update':
+        return {'rowid': bind_parameters[-1]}
+    return {'rowid': cursor.lastrowid}
+
+def bulk_insert_update_rows(dal, table_name, rows, schema=None, all_or_nothing=False):
+    """Insert/update many rows in one transaction. Rows are grouped by column set (i.e. identical SQL) and each group
+    written with one executemany(), rather than a statement (and transaction) per row.
+    If a group fails (constraint violation, missing rowid for update, etc.) it is rolled back and its rows
+    written one at a time so good rows are kept and the failing rows reported.
+    all_or_nothing, any error rolls back all rows.
+    Returns list of per row results (same order as rows), dicts of either rowid or error.
+    Committed before returning, see DatabaseWrapper.write()
+    """
+    schema = schema or dal.schema.get(table_name)
+    schema_column_names = set(x[0] for x in schema)
+    results = [None] * len(rows)
+    groups = OrderedDict()  # (sql, operation) -> list of (row index, bind parameters)
+    for row_index, row in enumerate(rows):
+        try:
+            key, bind_parameters = bulk_row_statement(table_name, schema_column_names, row)
+        except ValueError as info:
+            results[row_index] = {'error': str(info)}
+            continue
+        groups.setdefault(key, []).append((row_index, bind_parameters))
+
+    dal.db.write(lambda connection: bulk_write_groups(connection, schema, rows, groups, results, all_or_nothing))
+    return results
+
+def bulk_write_groups(connection, schema, rows, groups, results, all_or_nothing):
+    """Write function (see DatabaseWrapper.write()) for bulk_insert_update_rows(), fills in results"""
+    cursor = connection.cursor()  # separate cursor, lastrowid/rowcount are per cursor
+    cursor.execute('SAVEPOINT sqlshite_bulk')
+    try:
+        for (sql, operation), group_rows in groups.items():
+            log.debug('bulk %s %d rows: %s', operation, len(group_rows), sql)
+            cursor.execute('SAVEPOINT sqlshite_bulk_group')
+            try:
+                start_time = timer()
+                cursor.executemany(sql, [x[1] for x in group_rows])
+                global_metrics.add('sql_execute_seconds', timer() - start_time)
+                global_metrics.add('sql_statements', 1)
+                if cursor.rowcount != len(group_rows):
+                    raise ValueError('%d of %d rows written' % (cursor.rowcount, len(group_rows)))  # e.g. update of missing rowid
+            except (sqlite3.Error, ValueError) as info:
+                log.info('bulk %s group failed (%s), retrying one row at a time', operation, info)
+                cursor.execute('ROLLBACK TO sqlshite_bulk_group')
+                cursor.execute('RELEASE sqlshite_bulk_group')
+                for row_index, bind_parameters in group_rows:
+                    results[row_index] = bulk_write_row(cursor, sql, operation, bind_parameters)
+                continue
+            cursor.execute('RELEASE sqlshite_bulk_group')
+            if operation == 'update':
+                for row_index, bind_parameters in group_rows:
+                    results[row_index] = {'rowid': bind_parameters[-1]}
+            else:
+                # executemany() does not report per row lastrowid. The table is write locked for the whole
+                # transaction and each insert without an explicit rowid gets max(rowid) + 1, so the group has
+                # consecutive rowids ending at last_insert_rowid() -- unless the rowid (INTEGER PRIMARY KEY) was given
+                last_rowid = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+                first_rowid = last_rowid - len(group_rows) + 1
+                rowid_alias = sqlshite.rowid_alias_column(schema)
+                for position, (row_index, bind_parameters) in enumerate(group_rows):
+                    rowid = first_rowid + position
+                    row = rows[row_index]
+                    if rowid_alias is not None and row.get(rowid_alias) is not None:
+                        rowid = row[rowid_alias]
+                    results[row_index] = {'rowid': rowid}
+        if all_or_nothing and any('error' in x for x in results):
+            cursor.execute('ROLLBACK TO sqlshite_bulk')
+            for result in results:
+                result.pop('rowid', None)
+        cursor.execute('RELEASE sqlshite_bulk')
+    except:
+        cursor.execute('ROLLBACK TO sqlshite_bulk')
+        cursor.execute('RELEASE sqlshite_bulk')
+        raise
+    finally:
+        cursor.close()
+
+def bulk_rows_json(environ, start_response, dal, table_name, schema, request_body=None):
+    """POST a json array of row objects, see bulk_insert_update_rows(). Also accepts {"rows": [...], "all_or_nothing": true}
+    Response is json; counts and per row results, in request order.
+    """
+    if environ['REQUEST_METHOD'] != 'POST':
+        start_response('405 Method Not Allowed', [('Content-type', 'text/plain'), ('Allow', 'POST')])
+        return [b'POST a json array of rows']
+    try:
+        payload = json.loads((request_body or b'').decode('utf-8'))
+    except ValueError as info:
+        start_response('400 Bad Request', [('Content-type', 'text/plain')])
+        return [to_bytes('invalid json: %s' % info)]
+    all_or_nothing = False
+    if isinstance(payload, dict):
+        all_or_nothing = bool(payload.get('all_or_nothing'))
+        payload = payload.get('rows')
+    if not isinstance(payload, list):
+        start_response('400 Bad Request', [('Content-type', 'text/plain')])
+        return [b'expected a json array of rows']
+    results = bulk_insert_update_rows(dal, table_name, payload, schema=schema, all_or_nothing=all_or_nothing)
+    error_count = len([x for x in results if 'error' in x])
+    committed = not (all_or_nothing and error_count)
+    return return_json(environ, start_response, {
+        'committed': committed,
+        'written': committed and len(results) - error_count or 0,
+        'errors': error_count,
+        'results': results,
+    })
+
+def is_import_path(path_info_list):
+    """True for /d/DATABASE_NAME/TABLE_NAME/import"""
+    return len(path_info_list) == 4 and path_info_list[0] == 'd' and path_info_list[3] == 'import'
+
+def import_rows(environ, start_response, dal, table_name):
+    """POST CSV (header row of column names) or NDJSON, see sqlshite.importer. The body is parsed as it is
+    read from wsgi.input (not buffered by handle_request()) and inserted import_batch_size rows per transaction.
+    Format is from ?format=csv|ndjson or the Content-Type. Response is a json summary, including rows/sec.
+    """
+    if environ['REQUEST_METHOD'] != 'POST':
+        start_response('405 Method Not Allowed', [('Content-type', 'text/plain'), ('Allow', 'POST')])
+        return [b'POST csv or ndjson']
+    get_dict = parse_qs(environ.get('QUERY_STRING', ''))
+    import_format = get_first_value(get_dict, 'format')
+    if not import_format:
+        content_type = environ.get('CONTENT_TYPE', '').lower()
+        import_format = 'ndjson' if 'json' in content_type else 'csv'  # application/x-ndjson, application/jsonl, ...
+    try:
+        batch_size = int(get_first_value(get_dict, 'batch_size') or dal_setting(dal, 'import_batch_size', DEFAULT_IMPORT_BATCH_SIZE))
+        content_length = int(environ.get('CONTENT_LENGTH') or 0) or None
+    except ValueError:
+        batch_size, content_length = None, None
+    if not batch_size or batch_size < 1 or import_format not in ('csv', 'ndjson'):
+        start_response('400 Bad Request', [('Content-type', 'text/plain')])
+        return [b'invalid format or batch_size']
+
+    def progress(summary):
+        log.info('import %s: %d rows inserted, %d errors, %s rows/sec', table_name, summary['rows_inserted'], summary['errors'], summary['rows_per_second'])
+
+    importer = TableImporter(dal.db, table_name, batch_size=batch_size, progress=progress)
+    lines = iter_text_lines(environ['wsgi.input'], length=content_length)
+    try:
+        if import_format == 'ndjson':
+            summary = import_ndjson(importer, lines)
+        else:
+            summary = import_csv(importer, lines)
+    except (ValueError, UnicodeDecodeError, csv.Error) as info:
+        # bad csv header, or undecodable input. Rows before the error are kept
+        summary = importer.finish()
+        summary['error_messages'].append(str(info))
+        start_response('400 Bad Request', [('Content-type', 'application/json; charset=utf-8')])
+        return [json.dumps(summary, indent=4).encode('utf-8')]
+    log.info('import %s: %d rows read, %d inserted, %d errors in %.3f seconds', table_name, summary['rows_read'], summary['rows_inserted'], summary['errors'], summary['seconds'])
+    return return_json(environ, start_response, summary)
+
+def comparable_value(value):
+    """Normalize a column value (from the database or coerce_function()) for change detection"""
+    value = export_value(value)  # dates/datetimes as the ISO text coerce_function() produces
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def update_changed_columns(dal, table_name, user_values_dict, rowid, schema=None):
+    """Update a row with only the columns whose (type coerced) value differs from the current row, no UPDATE at
+    all if nothing changed. Empty values ('') are NULL for non-text columns, see coerce_function().
+    Columns not in user_values_dict (never sent by the form) are left alone, as are blobs (the form has no way to edit them).
+    Optimistic concurrency if the table has a "version_column" setting (integer); the posted value must
+    match the current value, and it is incremented by each update. The UPDATE also checks the version, so a
+    change between the read and the update is a conflict too.
+    Returns dict; rowid (new rowid if an INTEGER PRIMARY KEY was changed) and changed (column names),
+    or error and status (404 or 409 for a version conflict).
+    """
+    schema = schema or dal.schema.get(table_name)
+    version_column = dal.table_setting(table_name, 'version_column')
+    form_values = {}
+    for metadata in schema:
+        column_name, python_type, dbms_type = metadata[0], metadata[1], metadata[2]
+        if column_name not in user_values_dict or 'BLOB' in (dbms_type or '').upper():
+            continue
+        value = user_values_dict[column_name]
+        try:
+            value = coerce_function(python_type)(value)
+        except ValueError:
+            pass  # not valid for the declared type, SQLite will store it as-is
+        form_values[column_name] = value
+    column_names = [x[0] for x in schema]
+    rowid_alias = sqlshite.rowid_alias_column(schema)
+    table_name_q = sqlshite.quote_identifier(table_name)
+
+    def write(connection):
+        cursor = connection.cursor()
+        try:
+            execute_sql(cursor, 'SELECT %s FROM %s WHERE rowid = ?' % (', '.join(sqlshite.quote_identifier(x) for x in column_names), table_name_q), (rowid,), dal=dal)
+            row = cursor.fetchone()
+            if row is None:
+                return {'error': 'row %d not found' % rowid, 'status': '404 NOT FOUND'}
+            current_values = dict(zip(column_names, row))
+            if version_column and version_column in form_values:
+                expected_version = form_values.pop(version_column)
+                if comparable_value(expected_version) != comparable_value(current_values[version_column]):
+                    return {'error': 'row %d was changed by someone else (%s %r, expected %r), reload and edit again' % (rowid, version_column, current_values[version_column], expected_version), 'status': '409 Conflict'}
+            changed = [x for x in column_names if x in form_values and comparable_value(form_values[x]) != comparable_value(current_values[x])]
+            new_rowid = rowid
+            if rowid_alias in changed:
+                new_rowid = form_values[rowid_alias]  # INTEGER PRIMARY KEY changed, so did the rowid
+            if not changed:
+                log.debug('update rowid %d, no changes', rowid)
+                return {'rowid': rowid, 'changed': changed}
+            assignments = ['%s = ?' % sqlshite.quote_identifier(x) for x in changed]
+            bind_parameters = [form_values[x] for x in changed]
+            if version_column:
+                assignments.append('%s = coalesce(%s, 0) + 1' % (sqlshite.quote_identifier(version_column), sqlshite.quote_identifier(version_column)))
+            bind_parameters.append(rowid)
+            sql = 'UPDATE %s SET %s WHERE rowid = ?' % (table_name_q, ', '.join(assignments))
+            if version_column:
+                sql += ' AND %s IS ?' % sqlshite.quote_identifier(version_column)
+                bind_parameters.append(current_values[version_column])
+            log.debug('sql: %s', sql)
+            execute_sql(cursor, sql, tuple(bind_parameters), dal=dal)
+            if cursor.rowcount == 0:
+                return {'error': 'row %d was changed by someone else, reload and edit again' % rowid, 'status': '409 Conflict'}
+            return {'rowid': new_rowid, 'changed': changed}
+        finally:
+            cursor.close()
+    return dal.db.write(write)  # committed, see "write_queue" config
 
 def return_json(environ, start_response, value):
     """return a json object
@@ -425,18 +1348,36 @@ def return_json(environ, start_response, value):
     start_response(status, headers)
     return [json.dumps(value, indent=4).encode('utf-8')]
 
-def parse_first_values(request_body):
+def parse_first_values(request_body, keep_blank_values=False):
     """Where request_body is parameter list from GET, POST form, etc.
+    keep_blank_values, include empty fields (as '') e.g. so an edit can clear a field
     """
     #  b'number=&str=qwertyuiop%5B&float=&date=&datetime=&bottles_of_beer=99&delimited+id='
-    print('add row request_body %r' % (request_body,))
-    value_dict = parse_qs(request_body.decode('utf-8'))
-    print('form values %s' % json.dumps(value_dict, indent=4))
+    value_dict = parse_qs(request_body.decode('utf-8'), keep_blank_values=keep_blank_values)
     for temp_key in value_dict:
         value_dict[temp_key] = value_dict[temp_key][0]  # throw away the rest
-    print('form values %s' % json.dumps(value_dict, indent=4))
+    log.debug('form values %r', value_dict)
     return value_dict
 
+def get_first_value(get_dict, key, default=None):
+    """Where get_dict is from parse_qs(), return the first value for key (or default)
+    """
+    value = get_dict.get(key)
+    if value:
+        return value[0]
+    return default
+
+def get_int_value(get_dict, key, default=None):
+    """Where get_dict is from parse_qs(), return the first value for key as an integer (or default if missing/invalid)
+    """
+    value = get_first_value(get_dict, key)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
 def add_row(environ, start_response, dal, table_name, schema=None, request_body=None):
     """Explore a table
     """
@@ -472,14 +1413,8 @@ Forefox (dev) did NOT offer time selection... and secs are masked out/not-sent :
     """
 
     if request_body:
-        #FIXME value_dict = parse_first_values(request_body)
         #  b'number=&str=qwertyuiop%5B&float=&date=&datetime=&bottles_of_beer=99&delimited+id='
-        print('add row request_body %r' % (request_body,))
-        value_dict = parse_qs(request_body.decode('utf-8'))
-        print('form values %s' % json.dumps(value_dict, indent=4))
-        for temp_key in value_dict:
-            value_dict[temp_key] = value_dict[temp_key][0]  # throw away the rest
-        print('form values %s' % json.dumps(value_dict, indent=4))
+        value_dict = parse_first_values(request_body)
         database_result = insert_update_row(dal, table_name, value_dict, schema=schema)
         rowid = database_result.get('rowid')
         if rowid:
@@ -520,14 +1455,443 @@ def sql_editor(environ, start_response, dal):
     if sql:
         return table_rows(environ, start_response, dal, table_name=None, schema=None, sql=sql, show_sql=True)
     # else
-    filename = os.path.join(host_dir, 'sql_editor.html')
-    start_response(status, headers)
-    content_type, result = serve_file(filename)
+    static_file = static_files.lookup('/sql_editor.html')
+    if static_file is None:
+        return not_found_404(environ, start_response)
+    return static_files.serve(environ, start_response, static_file)
+
+def sorting_from_request(get_dict, schema, url_parameters=None):
+    """Server side sort state from ?sort=COLUMN&dir=asc|desc, validated against schema (blob columns are not sortable).
+    Returns dict; sort_column (None if missing/invalid, i.e. rowid order), descending, sort_column_index (position
+    in a "rowid, *" result row), sortable_columns, and url_parameters (to preserve in column header sort links, e.g. quick search)
+    """
+    requested_column = get_first_value(get_dict, 'sort')
+    sorting = {
+        'sort_column': None,
+        'descending': False,
+        'sort_column_index': None,
+        'sortable_columns': [],
+        'url_parameters': dict(url_parameters or {}),
+    }
+    for position, metadata in enumerate(schema or []):
+        column_name, dbms_type = metadata[0], metadata[2]
+        if 'BLOB' in (dbms_type or '').upper():
+            continue  # keyset values are passed in URLs as json
+        sorting['sortable_columns'].append(column_name)
+        if column_name == requested_column:
+            sorting['sort_column'] = column_name
+            sorting['descending'] = get_first_value(get_dict, 'dir') == 'desc'
+            sorting['sort_column_index'] = 1 + position
+    return sorting
+
+def list_url_parameters(get_dict, url_parameters=None):
+    """Returns url_parameters (dict) plus listing GET parameters to preserve in sort/paging links, i.e. cols"""
+    result = dict(url_parameters or {})
+    cols = get_first_value(get_dict, 'cols')
+    if cols:
+        result['cols'] = cols
+    return result
+
+def projection_from_request(get_dict, dal, table_name, schema, sorting=None):
+    """Columns for a row listing from ?cols=a,b,c or "columns" table setting (default all), validated against schema.
+    The sort column (if any) is always included. Returns dict; columns, kinds (per column, 'text' and 'blob' are
+    previews, see projection_select_list()) and preview_length.
+    """
+    requested = get_first_value(get_dict, 'cols')
+    if requested:
+        requested = [x.strip() for x in requested.split(',')]
+    else:
+        requested = dal.table_setting(table_name, 'columns')
+    schema_types = dict((x[0], (x[1], x[2])) for x in schema)
+    column_names = [x for x in requested or [] if x in schema_types] or [x[0] for x in schema]
+    sort_column = sorting and sorting['sort_column']
+    if sort_column and sort_column not in column_names:
+        column_names.append(sort_column)
+    preview_length = dal.table_setting(table_name, 'preview_length', dal_setting(dal, 'preview_length', DEFAULT_PREVIEW_LENGTH))
+    kinds = []
+    for column_name in column_names:
+        python_type, dbms_type = schema_types[column_name]
+        kind = None
+        if preview_length and column_name != sort_column:  # sort column value is needed for keyset paging
+            if 'BLOB' in (dbms_type or '').upper():
+                kind = 'blob'
+            elif python_type is str:
+                kind = 'text'
+        kinds.append(kind)
+    return {
+        'columns': column_names,
+        'kinds': kinds,
+        'preview_length': preview_length,
+    }
+
+def projection_select_list(projection, table_alias=None):
+    """Returns SQL select list for projection, large values are not fetched in full;
+    text is truncated (substr) to one more than preview_length characters (to detect truncation)
+    and blobs are replaced by their length
+    """
+    result = []
+    prefix = table_alias and table_alias + '.' or ''
+    for column_name, kind in zip(projection['columns'], projection['kinds']):
+        column_name_q = sqlshite.quote_identifier(column_name)
+        if kind == 'text':
+            result.append('substr(%s%s, 1, %d) as %s' % (prefix, column_name_q, projection['preview_length'] + 1, column_name_q))
+        elif kind == 'blob':
+            result.append('length(%s%s) as %s' % (prefix, column_name_q, column_name_q))
+        else:
+            result.append(prefix + column_name_q)
+    return ', '.join(result)
+
+def value_url(dal, table_name, rowid, column_name, operation='value'):
+    """URL for full column value, operation is 'value' or 'blob' (streamed)"""
+    return '/d/%s/%s/%s/%d/%s' % (quote(dal.name, safe=''), quote(table_name, safe=''), operation, rowid, quote(column_name, safe=''))
+
+def preview_cell_html(dal, table_name, rowid, column_name, kind, column_value, preview_length, column_value_template):
+    """Returns html table cell, with link to full value if column_value is a truncated preview
+    """
+    if column_value is not None:
+        if kind == 'text' and len(column_value) > preview_length:
+            return '<td>' + column_value_template % escape_html(column_value[:preview_length]) + '&hellip; <a href="%s">more</a></td>' % escape_html(value_url(dal, table_name, rowid, column_name))
+        elif kind == 'blob':
+            return '<td><a href="%s">[%d bytes]</a></td>' % (escape_html(value_url(dal, table_name, rowid, column_name, 'blob')), column_value)
+    return '<td>' + column_value_template % escape_html(unicode(column_value)) + '</td>'
+
+def get_key_value(get_dict, key):
+    """Returns (found, value) for json encoded keyset value, e.g. ?after_key=..."""
+    value = get_first_value(get_dict, key)
+    if value is None:
+        return False, None
+    try:
+        return True, json.loads(value)
+    except ValueError:
+        return False, None
+
+def paging_from_request(get_dict, table_name, where_sql=None, where_bind_parameters=None, url_parameters=None, sorting=None, projection=None):
+    """Keyset paging state from GET parameters, ?after=ROWID&limit=N or ?before=ROWID&limit=N
+    where_sql is an optional (un-parenthesized) condition with ? bind markers, e.g. for quick search.
+    url_parameters are extra GET parameters to preserve in next/prev links, e.g. {'q': 'search term'}.
+    sorting is from sorting_from_request(), if there is a sort column rows are ordered by (COLUMN, rowid)
+    and after/before also need after_key/before_key (json) with the COLUMN value of that row.
+    projection is from projection_from_request(), default is all columns.
+    """
+    limit = get_int_value(get_dict, 'limit', global_config.get('page_size', DEFAULT_PAGE_SIZE))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    url_parameters = dict(url_parameters or {})
+    sort_column = sorting and sorting['sort_column']
+    descending = sort_column and sorting['descending']
+    sort_column_index = sort_column and sorting['sort_column_index']
+    select_list = '*'
+    if projection:
+        select_list = projection_select_list(projection)
+        if sort_column:
+            sort_column_index = 1 + projection['columns'].index(sort_column)  # result is rowid, columns
+    after = get_int_value(get_dict, 'after')
+    before = get_int_value(get_dict, 'before')
+    after_key = before_key = None
+    if sort_column:
+        url_parameters['sort'] = sort_column
+        if descending:
+            url_parameters['dir'] = 'desc'
+        found, after_key = get_key_value(get_dict, 'after_key')
+        if not found:
+            after = None
+        found, before_key = get_key_value(get_dict, 'before_key')
+        if not found:
+            before = None
+    return {
+        'table_name': table_name,
+        'where_sql': where_sql,
+        'where_bind_parameters': tuple(where_bind_parameters or ()),
+        'select_list': select_list,
+        'url_parameters': url_parameters,
+        'sort_column': sort_column or None,  # None means rowid order
+        'descending': bool(descending),
+        'sort_column_index': sort_column_index or None,  # position of sort column in result row
+        'after': after,
+        'after_key': after_key,
+        'before': before,
+        'before_key': before_key,
+        'limit': limit,
+        # populated by row renderer, see paging_track_row()
+        'first_rowid': None,
+        'first_key': None,
+        'last_rowid': None,
+        'last_key': None,
+    }
+
+def paging_track_row(paging, row):
+    """Record keyset position of first/last row on page, row includes leading rowid"""
+    key = None
+    if paging['sort_column_index'] is not None:
+        key = row[paging['sort_column_index']]
+    if paging['first_rowid'] is None:
+        paging['first_rowid'] = row[0]
+        paging['first_key'] = key
+    paging['last_rowid'] = row[0]
+    paging['last_key'] = key
+
+def qualified_column(table_name, column_name):
+    """Returns table qualified, quoted, column name. Qualified so it can not be confused with a select list alias"""
+    if column_name is None:
+        return None
+    return sqlshite.quote_identifier(table_name) + '.' + sqlshite.quote_identifier(column_name)
+
+def keyset_condition(column_name_q, descending, key, rowid):
+    """Returns (sql condition, bind parameters) for rows after (key, rowid) when ordered by column_name_q, rowid
+    (both asc, or both desc). If column_name_q (quoted) is None, order is rowid only.
+    SQLite sorts NULLs first (asc) so they need special handling.
+    """
+    operator = '<' if descending else '>'
+    if column_name_q is None:
+        return 'rowid %s ?' % operator, [rowid]
+    if key is None:
+        if descending:
+            # NULLs are last, only NULLs (with a lower rowid) left
+            return '(%s IS NULL AND rowid < ?)' % column_name_q, [rowid]
+        return '((%s IS NULL AND rowid > ?) OR %s IS NOT NULL)' % (column_name_q, column_name_q), [rowid]
+    condition = '%s %s ? OR (%s = ? AND rowid %s ?)' % (column_name_q, operator, column_name_q, operator)
+    if descending:
+        condition += ' OR %s IS NULL' % column_name_q
+    return '(%s)' % condition, [key, key, rowid]
+
+def order_by_sql(column_name_q, descending):
+    """ORDER BY clause (without ORDER BY) for column_name_q (quoted), rowid"""
+    direction = ' desc' if descending else ''
+    if column_name_q is None:
+        return 'rowid' + direction
+    return '%s%s, rowid%s' % (column_name_q, direction, direction)
+
+def sorted_sql(sql, column_name, descending):
+    """Wrap (select rowid as sqlite_rowid, ...) sql to sort its results, e.g. a capped quick search"""
+    direction = ' desc' if descending else ''
+    return 'select * from (%s) order by %s%s, sqlite_rowid%s' % (sql, sqlshite.quote_identifier(column_name), direction, direction)
+
+def paged_rows_sql(paging):
+    """Returns sql, bind_parameters for a single page of rows.
+    Uses keyset (seek) on rowid, or (sort column, rowid), rather than OFFSET so cost is O(page size) no matter
+    how deep the page is (given an index on the sort column).
+    NOTE assumes rowid table (i.e. not WITHOUT ROWID), an INTEGER PRIMARY KEY is an alias for rowid.
+    """
+    conditions = []
+    bind_parameters = []
+    if paging['where_sql']:
+        conditions.append('(%s)' % paging['where_sql'])
+        bind_parameters.extend(paging['where_bind_parameters'])
+    sort_column, descending = paging['sort_column'], paging['descending']
+    sort_column_q = qualified_column(paging['table_name'], sort_column)
+    if paging['before'] is not None:
+        # walk backwards, i.e. after in the reverse order
+        descending = not descending
+        condition, condition_bind_parameters = keyset_condition(sort_column_q, descending, paging['before_key'], paging['before'])
+        conditions.append(condition)
+        bind_parameters.extend(condition_bind_parameters)
+    elif paging['after'] is not None:
+        condition, condition_bind_parameters = keyset_condition(sort_column_q, descending, paging['after_key'], paging['after'])
+        conditions.append(condition)
+        bind_parameters.extend(condition_bind_parameters)
+    where_str = ''
+    if conditions:
+        where_str = ' where ' + ' and '.join(conditions)
+    sql = 'select rowid as sqlite_rowid, %s from "%s"%s order by %s limit ?' % (paging['select_list'], paging['table_name'], where_str, order_by_sql(sort_column_q, descending))
+    bind_parameters.append(paging['limit'])
+    if paging['before'] is not None:
+        # walked backwards, display in requested order
+        if sort_column is None:
+            sql = 'select * from (%s) order by sqlite_rowid%s' % (sql, ' desc' if paging['descending'] else '')
+        else:
+            sql = sorted_sql(sql, sort_column, paging['descending'])
+    return sql, tuple(bind_parameters)
+
+def paging_rows_exist(dal, paging, backwards, rowid, key):
+    """Check if there are any (matching) rows before (backwards) or after the (key, rowid) position
+    Index seek, does not count rows.
+    """
+    descending = paging['descending']
+    if backwards:
+        descending = not descending
+    condition, bind_parameters = keyset_condition(qualified_column(paging['table_name'], paging['sort_column']), descending, key, rowid)
+    conditions = [condition]
+    if paging['where_sql']:
+        conditions.insert(0, '(%s)' % paging['where_sql'])
+        bind_parameters[:0] = paging['where_bind_parameters']
+    sql = 'select 1 from "%s" where %s limit 1' % (paging['table_name'], ' and '.join(conditions))
+    cursor = dal.db.cursor
+    execute_sql(cursor, sql, tuple(bind_parameters), dal=dal)
+    return cursor.fetchone() is not None
+
+def paging_url(paging, extra_parameters, keep_limit=True):
+    """Returns (html escaped) relative URL with paging url_parameters and extra_parameters"""
+    url_parameters = dict(paging['url_parameters'])
+    url_parameters.update(extra_parameters)
+    if keep_limit and paging['limit'] != global_config.get('page_size', DEFAULT_PAGE_SIZE):
+        url_parameters['limit'] = paging['limit']
+    url_parameters = dict((key, value) for key, value in url_parameters.items() if value is not None)
+    return escape_html('?' + urlencode(sorted(url_parameters.items())))
+
+def paging_links_html(dal, paging):
+    """Returns html string with first/prev/next links for the current page
+    """
+    links = []
+    sorted_by_column = paging['sort_column'] is not None
+
+    def key_parameter(name, key):
+        if sorted_by_column:
+            return {name: json.dumps(key, default=str)}
+        return {}
+
+    if paging['after'] is not None or paging['before'] is not None:
+        links.append('<a href="%s">first</a>' % paging_url(paging, {}))
+    if paging['first_rowid'] is not None and paging_rows_exist(dal, paging, True, paging['first_rowid'], paging['first_key']):
+        parameters = {'before': paging['first_rowid']}
+        parameters.update(key_parameter('before_key', paging['first_key']))
+        links.append('<a href="%s">&laquo; prev</a>' % paging_url(paging, parameters))
+    if paging['last_rowid'] is not None and paging_rows_exist(dal, paging, False, paging['last_rowid'], paging['last_key']):
+        parameters = {'after': paging['last_rowid']}
+        parameters.update(key_parameter('after_key', paging['last_key']))
+        links.append('<a href="%s">next &raquo;</a>' % paging_url(paging, parameters))
+    return '  '.join(links)
+
+def column_headers(column_names, sorting=None):
+    """Returns list of html strings for rows_html_table.html column headers, with sort links if sortable.
+    sorting is from sorting_from_request(), its url_parameters (e.g. quick search q and mode) are preserved
+    in sort links, paging is reset.
+    """
+    result = []
+    for column_name in column_names:
+        header_html = escape_html(column_name)
+        if sorting and column_name in sorting['sortable_columns']:
+            url_parameters = dict(sorting['url_parameters'])
+            url_parameters['sort'] = column_name
+            sort_indicator = ''
+            if column_name == sorting['sort_column']:
+                if sorting['descending']:
+                    sort_indicator = ' &#9660;'
+                else:
+                    sort_indicator = ' &#9650;'
+                    url_parameters['dir'] = 'desc'  # click again to toggle
+            header_html = '<a href="%s">%s</a>%s' % (escape_html('?' + urlencode(sorted(url_parameters.items()))), header_html, sort_indicator)
+        result.append(header_html)
     return result
 
-def table_rows(environ, start_response, dal, table_name, schema=None, sql=None, bind_parameters=None, rowid_first_column_in_result=False, show_sql=False, html_top_inject=None):
-    #return table_rows_stream_html_table(environ, start_response, dal, table_name, schema=schema, sql=sql, bind_parameters=bind_parameters, rowid_first_column_in_result=rowid_first_column_in_result, show_sql=show_sql)
-    return table_rows_template_html_table(environ, start_response, dal, table_name, schema=schema, sql=sql, bind_parameters=bind_parameters, rowid_first_column_in_result=rowid_first_column_in_result, show_sql=show_sql, html_top_inject=html_top_inject)
+def get_change_tracker(dal):
+    change_tracker = global_change_trackers.get(dal.name)
+    if change_tracker is None:
+        global_result_caches_lock.acquire()
+        try:
+            change_tracker = global_change_trackers.setdefault(dal.name, ChangeTracker())
+        finally:
+            global_result_caches_lock.release()
+    return change_tracker
+
+def get_result_cache(dal):
+    """Returns ResultCache for database, or None if disabled (result_cache_entries set to 0)
+    """
+    result_cache = global_result_caches.get(dal.name)
+    if result_cache is None:
+        max_entries = dal_setting(dal, 'result_cache_entries', DEFAULT_RESULT_CACHE_ENTRIES)
+        if not max_entries:
+            return None
+        change_tracker = get_change_tracker(dal)  # outside of lock, it uses the same (non-reentrant) lock
+        global_result_caches_lock.acquire()
+        try:
+            result_cache = global_result_caches.get(dal.name)
+            if result_cache is None:
+                result_cache = global_result_caches[dal.name] = ResultCache(change_tracker, max_entries=max_entries, max_bytes=dal_setting(dal, 'result_cache_max_bytes', DEFAULT_RESULT_CACHE_MAX_BYTES))
+        finally:
+            global_result_caches_lock.release()
+    return result_cache
+
+def cache_result_iter(environ, result, result_cache, key, generation):
+    """Pass through response chunks, storing complete (error free) response in result_cache.
+    Stops collecting once the response is larger than the cache (max_bytes), it would never be stored.
+    """
+    chunks = []
+    size = 0
+    for chunk in result:
+        if chunks is not None:
+            size += len(chunk)
+            if size > result_cache.max_bytes:
+                chunks = None  # too big to cache
+            else:
+                chunks.append(chunk)
+        yield chunk
+    if chunks is not None and not environ.get('sqlshite.sql_error'):
+        result_cache.put(key, generation, b''.join(chunks))
+
+def invalidate_after_iter(result, invalidate):
+    """Pass through response chunks, then call invalidate(), e.g. for user SQL which may write (or change schema)
+    """
+    for chunk in result:
+        yield chunk
+    invalidate()
+
+def data_etag(environ, dal, *identity):
+    """ETag for a dynamic page, from database changes (see ChangeTracker), schema version, and
+    identity (e.g. table name and rowid). Costs a PRAGMA data_version, no row queries.
+    """
+    change_tracker = get_change_tracker(dal)
+    generation = change_tracker.check_changes(dal.db)
+    environ['sqlshite.generation'] = generation  # for result cache lookup
+    identity_hash = hashlib.sha1(repr(identity).encode('utf-8')).hexdigest()[:16]
+    return '"%s-%d-%d-%s"' % (change_tracker.instance, generation, dal.schema_version, identity_hash)
+
+def start_response_add_headers(start_response, extra_headers):
+    """Returns start_response wrapper that adds extra_headers to 200 responses"""
+    def add_headers_start_response(status, headers, exc_info=None):
+        if status.startswith('200'):
+            headers = list(headers) + extra_headers
+        return start_response(status, headers, exc_info)
+    return add_headers_start_response
+
+def conditional_get(environ, start_response, dal, *identity):
+    """ETag handling for dynamic pages. Returns (start_response, response), response is a 304 response
+    if the client copy is current, otherwise None and start_response adds the ETag header.
+    """
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        return start_response, None
+    etag = data_etag(environ, dal, *identity)
+    headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+    if etag_matches(environ, etag):
+        return start_response, not_modified_304(environ, start_response, headers)
+    return start_response_add_headers(start_response, headers), None
+
+def table_rows(environ, start_response, dal, table_name, schema=None, sql=None, bind_parameters=None, rowid_first_column_in_result=False, show_sql=False, html_top_inject=None, paging=None, sorting=None, projection=None):
+    """Render rows from table_name (or sql), using the result cache (if enabled) for generated SQL.
+    User SQL (show_sql) is never cached.
+    sorting (from sorting_from_request()) generates column header sort links, otherwise the
+    columns are sorted client side (only the rows on the page).
+    projection (from projection_from_request()) must match the sql (or paging) select list.
+    """
+    if paging:
+        sql, bind_parameters = paged_rows_sql(paging)
+        rowid_first_column_in_result = True
+    if global_config.get('stream_rows', True):
+        renderer = table_rows_stream_html_table
+    else:
+        renderer = table_rows_template_html_table
+
+    result_cache = get_result_cache(dal)
+    if show_sql:
+        result = renderer(environ, start_response, dal, table_name, schema=schema, sql=sql, bind_parameters=bind_parameters, rowid_first_column_in_result=rowid_first_column_in_result, show_sql=show_sql, html_top_inject=html_top_inject, paging=paging, sorting=sorting, projection=projection)
+        return invalidate_after_iter(result, result_cache.invalidate if result_cache else get_change_tracker(dal).bump)
+    if result_cache is None:
+        return renderer(environ, start_response, dal, table_name, schema=schema, sql=sql, bind_parameters=bind_parameters, rowid_first_column_in_result=rowid_first_column_in_result, show_sql=show_sql, html_top_inject=html_top_inject, paging=paging, sorting=sorting, projection=projection)
+
+    generation = environ.get('sqlshite.generation')  # already checked for ETag
+    if generation is None:
+        generation = get_change_tracker(dal).check_changes(dal.db)
+    key = (
+        table_name, sql, tuple(bind_parameters or ()), html_top_inject,
+        paging and (paging['after'], paging['before'], paging['limit'], tuple(sorted((paging['url_parameters'] or {}).items()))),  # url_parameters, e.g. raw cols, are in links
+        projection and (tuple(projection['columns']), tuple(projection['kinds']), projection['preview_length']),
+    )
+    body = result_cache.get(key, generation)
+    if body is not None:
+        global_metrics.count('sqlshite_result_cache_hits_total', (('database', dal.name),))
+        start_response('200 OK', [('Content-type', 'text/html'), ('Content-Length', str(len(body)))])
+        return [body]
+    global_metrics.count('sqlshite_result_cache_misses_total', (('database', dal.name),))
+    result = renderer(environ, start_response, dal, table_name, schema=schema, sql=sql, bind_parameters=bind_parameters, rowid_first_column_in_result=rowid_first_column_in_result, show_sql=show_sql, html_top_inject=html_top_inject, paging=paging, sorting=sorting, projection=projection)
+    return cache_result_iter(environ, result, result_cache, key, generation)
 
 def table_row_html_generator(dal, cursor, rowid_first_column_in_result, table_name):
     row = cursor.fetchone()
@@ -547,28 +1911,73 @@ def table_row_html_generator(dal, cursor, rowid_first_column_in_result, table_na
         yield '</tr>\n'
         row = cursor.fetchone()
 
-def table_row_html_buffered(dal, cursor, rowid_first_column_in_result, table_name):
+def table_row_html_batches(dal, cursor, rowid_first_column_in_result, table_name, paging=None, stats=None, batch_size=None, projection=None):
+    """Generator, yields html string for a batch of rows at a time, using cursor.fetchmany()
+    so at most batch_size rows are held in memory.
+    Updates stats['row_count'] and paging first/last rowid as rows are rendered.
+    projection (see projection_from_request()) if set, is the column order of the result and
+    shows truncated values as previews.
+    """
+    if not rowid_first_column_in_result:
+        projection = None  # no link to full value without rowid
+    batch_size = batch_size or global_config.get('row_batch_size', DEFAULT_ROW_BATCH_SIZE)
+    rows = fetchmany_timed(cursor, batch_size)
+    while rows:
+        result = []
+        for row in rows:
+            result.append('<tr>\n')
+            if rowid_first_column_in_result:
+                if paging is not None:
+                    paging_track_row(paging, row)
+                rowid = row[0]
+                row = row[1:]
+                column_value_template = '<a href="/d/%s/%s/view/%d/">%%s</a>' % (dal.name, table_name, rowid)  # TODO escaping?
+            else:
+                column_value_template = '%s'
+            if projection is not None:
+                preview_length = projection['preview_length']
+                for column_name, kind, column_value in zip(projection['columns'], projection['kinds'], row):
+                    result.append(preview_cell_html(dal, table_name, rowid, column_name, kind, column_value, preview_length, column_value_template))
+            else:
+                for column_value in row:
+                    result.append("<td>" + column_value_template % escape_html(unicode(column_value)) + "</td>")  # FIXME string processng, for example boolean to check-box
+            result.append('</tr>\n')
+        if stats is not None:
+            stats['row_count'] += len(rows)
+        yield ''.join(result)
+        rows = fetchmany_timed(cursor, batch_size)
+
+def table_row_html_buffered(dal, cursor, rowid_first_column_in_result, table_name, paging=None, projection=None):
+    if not rowid_first_column_in_result:
+        projection = None  # no link to full value without rowid
     result = []
-    row = cursor.fetchone()
+    row = fetchone_timed(cursor)
     row_count = 0
     while row:
         row_count += 1
         result.append('<tr>\n')
         if rowid_first_column_in_result:
+            if paging is not None:
+                paging_track_row(paging, row)
             rowid = row[0]
             row = row[1:]
             column_value_template = '<a href="/d/%s/%s/view/%d/">%%s</a>' % (dal.name, table_name, rowid)  # TODO escaping?
         else:
             column_value_template = '%s'
-        for column_value in row:
-            tmp_str = "<td>" + column_value_template % escape_html(unicode(column_value)) + "</td>"  # FIXME string processng, for example boolean to check-box
-            result.append(tmp_str)
+        if projection is not None:
+            for column_name, kind, column_value in zip(projection['columns'], projection['kinds'], row):
+                result.append(preview_cell_html(dal, table_name, rowid, column_name, kind, column_value, projection['preview_length'], column_value_template))
+        else:
+            for column_value in row:
+                tmp_str = "<td>" + column_value_template % escape_html(unicode(column_value)) + "</td>"  # FIXME string processng, for example boolean to check-box
+                result.append(tmp_str)
         result.append('</tr>\n')
-        row = cursor.fetchone()
+        row = fetchone_timed(cursor)
     return ''.join(result), row_count
 
-def table_rows_template_html_table(environ, start_response, dal, table_name, schema=None, sql=None, bind_parameters=None, rowid_first_column_in_result=False, show_sql=False, html_top_inject=None):
+def table_rows_template_html_table(environ, start_response, dal, table_name, schema=None, sql=None, bind_parameters=None, rowid_first_column_in_result=False, show_sql=False, html_top_inject=None, paging=None, sorting=None, projection=None):
     """Buffer rows from table/arbitary SQL query in a html table into a template then return
+    If paging (see paging_from_request()) is set, sql is for a single page and next/prev links are generated
     """
     status = '200 OK'
     headers = [('Content-type', 'text/html')]
@@ -581,38 +1990,56 @@ def table_rows_template_html_table(environ, start_response, dal, table_name, sch
     # TODO see if can detect primary key, and not assume rowid (ala rowid_first_column_in_result)
     sql = sql or 'select rowid as sqlite_rowid, * from "%s"' % table_name
     cursor = dal.db.cursor
-    if bind_parameters:
-        cursor.execute(sql, bind_parameters)
-    else:
-        cursor.execute(sql)
-    column_names = list(x[0] for x in cursor.description)  # or use schema... has more detail (at least for SQLite)
-    if column_names[0] == 'rowid':
+    query_stats = QueryStats(dal, sql, bind_parameters, explain=show_sql)
+    query_stats.start()
+    try:
+        execute_sql(cursor, sql, bind_parameters)
+    except:
+        query_stats.stop_counting()
+        raise
+    column_names = list(x[0] for x in cursor.description or ())  # or use schema... has more detail (at least for SQLite). description is None for non-SELECT
+    if column_names and column_names[0] == 'rowid':
         rowid_first_column_in_result = True
     """ If we can determine table name, can check for rowid....
     if rowid_first_column_in_result:
         column_names = column_names[1:]
     """
-    if rowid_first_column_in_result:
+    if rowid_first_column_in_result and column_names:
         del(column_names[0])
     if not show_sql:
         sql = None
 
     # rows_html = table_row_html_generator(dal, cursor, rowid_first_column_in_result, table_name)
-    rows_html, row_count = table_row_html_buffered(dal, cursor, rowid_first_column_in_result, table_name)
+    try:
+        rows_html, row_count = table_row_html_buffered(dal, cursor, rowid_first_column_in_result, table_name, paging=paging, projection=projection)
+    finally:
+        query_stats.stop_counting()
+    query_stats.finish(row_count)
+    if paging:
+        page_links_html = paging_links_html(dal, paging)
+    else:
+        page_links_html = None
     result.append(render_template('rows_html_table.html', {
         'database_name': dal.name,
         'table_name': table_name or 'user SQL query',
-        'column_names': column_names,
+        'column_headers': column_headers(column_names, sorting),
+        'client_sort': sorting is None,
         'rows_html': rows_html,
         #'rows_html': table_row_html_generator(dal, cursor, rowid_first_column_in_result, table_name),
         'row_count': row_count,  # cursor.rowcount,  # not set at this point in time
         'html_top_inject': html_top_inject,
+        'page_links_html': page_links_html,
+        'query_stats_html': query_stats.html() if show_sql else None,
     }))
     start_response(status, headers)
     return result
 
-def table_rows_stream_html_table(environ, start_response, dal, table_name, schema=None, sql=None, bind_parameters=None, rowid_first_column_in_result=False, show_sql=False):
+def table_rows_stream_html_table(environ, start_response, dal, table_name, schema=None, sql=None, bind_parameters=None, rowid_first_column_in_result=False, show_sql=False, html_top_inject=None, paging=None, sorting=None, projection=None):
     """Stream rows in table/arbitary SQL query in a html table
+    Uses the rows_html_table.html template split into head/row/tail, the head is sent as soon as the query
+    is executed then rows are sent one chunk per cursor.fetchmany() batch. Time-to-first-byte and peak memory
+    stay flat regardless of the number of rows.
+    If paging (see paging_from_request()) is set, sql is for a single page and next/prev links are generated
     """
     status = '200 OK'
     headers = [('Content-type', 'text/html')]
@@ -622,126 +2049,117 @@ def table_rows_stream_html_table(environ, start_response, dal, table_name, schem
     else:
         rowid_first_column_in_result = True
     sql = sql or 'select rowid as sqlite_rowid, * from "%s"' % table_name
+    template_head, template_row, template_tail = template_cache.split('rows_html_table.html', 'rows_html')
+    row_prefix, row_suffix = template_row.split('{{{.}}}', 1)
+    variables = {
+        'database_name': dal.name,
+        'table_name': table_name or 'user SQL query',
+        'html_top_inject': html_top_inject,
+        'client_sort': sorting is None,
+    }
     cursor = dal.db.cursor
+    query_stats = QueryStats(dal, sql, bind_parameters, explain=show_sql)
     start_response(status, headers)
     try:
-        if bind_parameters:
-            cursor.execute(sql, bind_parameters)
-        else:
-            cursor.execute(sql)
-        column_names = list(x[0] for x in cursor.description)  # or use schema... has more detail (at least for SQLite)
-        if rowid_first_column_in_result:
-            column_names = column_names[1:]
-        row = cursor.fetchone()
-        yield '''<!doctype html>
-    <html lang="en">
-      <head>
-        <meta charset="utf-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
-        <meta name="description" content="">
-        <meta name="author" content="">
-
-      <title>{{table_name}} SQLshite rows</title>
-      <link rel="stylesheet" type="text/css" href="/css/bootstrap.css" />
-      <script type="text/javascript" src="/js/jquery.min.js"></script>
-      <script type="text/javascript" src="/js/tablesort.min.js"></script>
-
-        <style>
-            th[role=columnheader]:not(.no-sort) {
-                cursor: pointer;
-            }
-
-            th[role=columnheader]:not(.no-sort):after {
-                content: '';
-                float: right;
-                margin-top: 7px;
-                border-width: 0 4px 4px;
-                border-style: solid;
-                border-color: #404040 transparent;
-                visibility: hidden;
-                opacity: 0;
-                -ms-user-select: none;
-                -webkit-user-select: none;
-                -moz-user-select: none;
-                user-select: none;
-            }
-
-            th[aria-sort=ascending]:not(.no-sort):after {
-                border-bottom: none;
-                border-width: 4px 4px 0;
-            }
-
-            th[aria-sort]:not(.no-sort):after {
-                visibility: visible;
-                opacity: 0.4;
-            }
-
-            th[role=columnheader]:not(.no-sort):hover:after {
-                visibility: visible;
-                opacity: 1;
-            }
-        </style>
-    </head>
-    <body>
-      <h1>{{table_name}} rows</h1>
-      <a href="../../">databases</a>  <a href="../">tables</a>  <a href="../">SQL</a></br>
-    '''.replace('{{table_name}}', escape_html(table_name or 'user SQL query')).encode('utf-8')
-        yield b'WIP, no paging/offset support</br>'
+        query_stats.start()
+        execute_sql(cursor, sql, bind_parameters)
+        column_names = list(x[0] for x in cursor.description or ())  # or use schema... has more detail (at least for SQLite). description is None for non-SELECT
+        if column_names and column_names[0] == 'rowid':
+            rowid_first_column_in_result = True
+        if rowid_first_column_in_result and column_names:
+            del(column_names[0])
+        variables['column_headers'] = column_headers(column_names, sorting)
+        yield template_cache.render(template_head, variables).encode('utf-8')
+
+        stats = {'row_count': 0}
+        for rows_html in table_row_html_batches(dal, cursor, rowid_first_column_in_result, table_name, paging=paging, stats=stats, projection=projection):
+            yield (row_prefix + rows_html + row_suffix).encode('utf-8')
+
+        variables['row_count'] = stats['row_count']
+        query_stats.finish(stats['row_count'])
         if show_sql:
-            # TODO code block and/or syntax highlighting
-            yield 'SQL: {{sql}}'.replace('{{sql}}', escape_html(sql)).encode('utf-8')
-        #yield b'<table border>\n    <tr>'  # table does not work well with default Bootstrap (at least on desktop, much better on mobile)
-        yield b'<table  class="table table-striped" id="sqlrows" name="sqlrows">\n'
-        yield b'<thead class="thead-dark">'  # this is not working, Bootstrap 4.0 feature?
-        yield b'    <tr>'
-        for column_name in column_names:
-            tmp_str = "<th>" + escape_html(column_name) + "</th>"
-            yield tmp_str.encode('utf-8')
-        yield b'</tr>\n'
-        yield b'</thead>\n'
-        yield b'<tbody>\n'
-        row_count = 0
-        while row:
-            row_count += 1
-            yield b'<tr>\n'
-            if rowid_first_column_in_result:
-                rowid = row[0]
-                row = row[1:]
-                column_value_template = '<a href="/d/%s/%s/view/%d/">%%s</a>' % (dal.name, table_name, rowid)  # TODO escaping?
-            else:
-                column_value_template = '%s'
-            for column_value in row:
-                tmp_str = "<td>" + column_value_template % escape_html(unicode(column_value)) + "</td>"  # FIXME string processng, for example boolean to check-box
-                yield tmp_str.encode('utf-8')
-            yield b'</tr>\n'
-            row = cursor.fetchone()
-        yield b'</tbody>\n'
-        yield b'</table>\n'
-        yield b'<script>\n'
-        yield b'''
-function onPageReady() {
-  // http://tristen.ca/tablesort/demo/ and https://github.com/tristen/tablesort
-  new Tablesort(document.getElementById('sqlrows'));
-}
-
-// Run the above function when the page is loaded & ready
-// TODO search all classes with sortable, instead of per table-id
-document.addEventListener('DOMContentLoaded', onPageReady, false);
-        \n'''
-        yield b'</script>\n'
-        row_count_str= '%d rows\n' % (row_count, )
-        yield row_count_str.encode('utf-8')
+            variables['query_stats_html'] = query_stats.html()
+        if paging:
+            variables['page_links_html'] = paging_links_html(dal, paging)
+        yield template_cache.render(template_tail, variables).encode('utf-8')
     except dal.db.driver.Error as info:  # better than Exception as info:
         log.error('sql error %r', info)
+        environ['sqlshite.sql_error'] = True  # do not cache
+        # NOTE may be part way through a table, headers have already been sent
         error_str ='<br><br>\n\n<span style="color:red">** ERROR **</span><br><br>' + escape_html(repr(info)) + escape_html(str(info)) +'<br><br>'
+        if show_sql:
+            # TODO code block and/or syntax highlighting
+            error_str += 'SQL: ' + escape_html(sql)
         yield error_str.encode('utf-8')
-    finally:
         yield b'''
 </body>
 </html>
 '''
+    finally:
+        query_stats.stop_counting()  # e.g. client disconnected part way through
     # TODO commit...
 
+def export_value(value):
+    """Column value for csv/ndjson export. Dates and datetimes are ISO 8601 text, the format the registered
+    converters read (datetime with a space separator, as stored by the sqlite3 module), blobs are hex.
+    Returns value unchanged for other types
+    """
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    elif isinstance(value, date):
+        return value.isoformat()
+    elif isinstance(value, (bytes, bytearray, memoryview)) and not isinstance(value, str):
+        return binascii.hexlify(value).decode('ascii')
+    return value
+
+def export_chunks(environ, dal, cursor, column_names, export_format):
+    """Generator, yields csv (header row first) or ndjson bytes, one chunk per cursor.fetchmany() batch
+    so memory use does not depend on the number of rows
+    """
+    batch_size = global_config.get('row_batch_size', DEFAULT_ROW_BATCH_SIZE)
+    buffer = io.StringIO() if str is not bytes else io.BytesIO()
+    if export_format == 'csv':
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(column_names)
+    try:
+        while True:
+            rows = fetchmany_timed(cursor, batch_size)
+            if not rows:
+                break
+            if export_format == 'csv':
+                writer.writerows([export_value(x) for x in row] for row in rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(column_names, row)), separators=(',', ':'), default=export_value))
+                    buffer.write('\n')
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')  # csv header, for no rows
+    except dal.db.driver.Error as info:
+        # NOTE headers have already been sent, output is truncated
+        log.error('export sql error %r', info)
+        environ['sqlshite.sql_error'] = True
+
+def export_rows(environ, start_response, dal, export_format, sql, bind_parameters=None, filename=None):
+    """Stream query results as csv or ndjson (see export_chunks()), straight from the cursor.
+    The query is executed before the response starts so SQL errors are a 400 rather than a truncated file
+    """
+    cursor = dal.db.cursor
+    try:
+        execute_sql(cursor, sql, bind_parameters, dal=dal)
+    except dal.db.driver.Error as info:
+        log.error('export sql error %r', info)
+        start_response('400 Bad Request', [('Content-type', 'text/plain; charset=utf-8')])
+        return [to_bytes('SQL error: %s' % info)]
+    column_names = [x[0] for x in cursor.description or ()]  # description is None for non-SELECT
+    headers = [('Content-type', EXPORT_CONTENT_TYPES[export_format])]
+    if filename:
+        headers.append(('Content-Disposition', 'attachment; filename="%s"' % filename.replace('"', '')))
+    start_response('200 OK', headers)
+    return export_chunks(environ, dal, cursor, column_names, export_format)
+
 def table_explore(environ, start_response, path_info=None, path_info_list=None, request_body=None):
     """Explore a table
     TODO redirect if not ending in / and database view
@@ -755,7 +2173,7 @@ def table_explore(environ, start_response, path_info=None, path_info_list=None,
     log.debug('path_info %r', path_info)
     log.debug('path_info_list %r', path_info_list)
 
-    if '?' not in path_info and not path_info.endswith('.json') and not path_info.endswith('/'):
+    if '?' not in path_info and not path_info.endswith(('.json', '.csv', '.ndjson')) and not path_info.endswith('/') and not (len(path_info_list) == 6 and path_info_list[3] in ('value', 'blob')) and not is_import_path(path_info_list):
         # dumb redirect
         log.debug('**** REDIRECT %r' % (path_info, ))
         start_response('302 Found', [('Location', path_info + '/')])
@@ -763,6 +2181,7 @@ def table_explore(environ, start_response, path_info=None, path_info_list=None,
 
     if len(path_info_list) == 4:
         if path_info.endswith('/jsonform.json'):
+            environ['sqlshite.route'] = 'jsonform'
             return jsonform(environ, start_response)
 
     # form GET -- TODO POST support
@@ -781,58 +2200,119 @@ def table_explore(environ, start_response, path_info=None, path_info_list=None,
 
     #current_path = '/'.join(path_info_list)  # TODO current full URL
     database = path_info_list[1]
-    dal = global_dbs.get(database)
+    dal = get_dal(database)
     if not dal:
         return not_found_404(environ, start_response)
 
     if len(path_info_list) == 3:
         if path_info_list[2] == 'sql':
             # maybe http://localhost/d/DATABASE_NAME/sql
+            environ['sqlshite.route'] = 'sql'
             return sql_editor(environ, start_response, dal)
         elif path_info_list[2] == 'rescan':
+            environ['sqlshite.route'] = 'rescan'
             return rescan(environ, start_response, dal)
+        elif path_info_list[2] == 'indexes':
+            environ['sqlshite.route'] = 'indexes'
+            return index_advisor(environ, start_response, dal, request_body=request_body)
+        elif path_info_list[2] in ('sql.csv', 'sql.ndjson'):
+            # http://localhost:8777/d/memory/sql.csv?sql_str=select+*+from+kitchen_sink
+            environ['sqlshite.route'] = 'export_sql'
+            sql = get_first_value(get_dict, 'sql_str')
+            if not sql:
+                return not_found_404(environ, start_response)
+            export_format = path_info_list[2].split('.', 1)[1]
+            result = export_rows(environ, start_response, dal, export_format, sql, filename='query.' + export_format)
+            result_cache = get_result_cache(dal)
+            return invalidate_after_iter(result, result_cache.invalidate if result_cache else get_change_tracker(dal).bump)  # user SQL may write
 
     table_name = path_info_list[2]
     schema = dal.schema.get(table_name)
     if not schema:
         return not_found_404(environ, start_response)
 
-    # TODO Full Text Search support
     if q:
         # we have a quick search query
-        quick_search_column_name = None  # FIXME config lookup option
-        if quick_search_column_name is None:
-            # find first string type, and use that for simple like to TABLE scan the entire table
-            for metadata in schema:
-                column_name, python_type = metadata[0], metadata[1]
-                if python_type is str:
-                    quick_search_column_name = column_name
-                    break
-        log.debug('quick_search_column_name %r', quick_search_column_name)
+        environ['sqlshite.route'] = 'quick_search'
         orig_q = q
-        if not q.startswith('%'):
-            q = '%' + q
-        if not q.endswith('%'):
-            q = q + '%'
-        sql = 'select rowid as sqlite_rowid, * from "%s" where "%s" like ?' % (table_name, quick_search_column_name)
+        # 'substring' (LIKE, or FTS if configured) or 'prefix' (index range scan)
+        quick_search_mode = get_first_value(get_dict, 'mode') or dal.table_setting(table_name, 'quick_search_mode', 'substring')
         html_top_inject = '''<form method="GET"  id="quick_search" name="quick_search">
-    quick search: <input type="text" name="q" id="q" value="%s"/><br>
+    quick search: <input type="text" name="q" id="q" value="%s"/>
+    <select name="mode" id="mode">
+        <option value="substring">contains</option>
+        <option value="prefix"%s>starts with</option>
+    </select><br>
     <button class="btn btn-primary" value="Submit"  type="submit">Search</button>
 </form>
 
-''' % (escape_html(orig_q),)  # or q
-        return table_rows(environ, start_response, dal, table_name=table_name, schema=schema, sql=sql, bind_parameters=(q, ), rowid_first_column_in_result=True, html_top_inject=html_top_inject)
+''' % (escape_html(orig_q), ' selected' if quick_search_mode == 'prefix' else '')  # or q
+        quick_search_limit = dal.table_setting(table_name, 'quick_search_limit', dal_setting(dal, 'quick_search_limit', DEFAULT_PAGE_SIZE))
+        quick_search_column_name = dal.quick_search_column(table_name)  # first string column, unless configured
+        log.debug('quick_search_column_name %r', quick_search_column_name)
+        url_parameters = list_url_parameters(get_dict, {'q': orig_q, 'mode': quick_search_mode})
+        sorting = sorting_from_request(get_dict, schema, url_parameters=url_parameters)
+        projection = projection_from_request(get_dict, dal, table_name, schema, sorting=sorting)
+        if quick_search_mode == 'prefix' and quick_search_column_name:
+            sql, bind_parameters = dal.prefix_search_sql(table_name, quick_search_column_name, orig_q, quick_search_limit, select_list=projection_select_list(projection))
+            if sorting['sort_column']:
+                sql = sorted_sql(sql, sorting['sort_column'], sorting['descending'])  # sort the capped results
+            return table_rows(environ, start_response, dal, table_name=table_name, schema=schema, sql=sql, bind_parameters=bind_parameters, rowid_first_column_in_result=True, html_top_inject=html_top_inject, sorting=sorting, projection=projection)
+
+        fts_query = dal.fts_search_sql(table_name, orig_q, quick_search_limit, select_list=projection_select_list(projection, table_alias='t'))  # None if table not configured for Full Text Search
+        if fts_query:
+            sql, bind_parameters = fts_query
+            if sorting['sort_column']:
+                sql = sorted_sql(sql, sorting['sort_column'], sorting['descending'])  # sort the capped results, rather than by rank
+            return table_rows(environ, start_response, dal, table_name=table_name, schema=schema, sql=sql, bind_parameters=bind_parameters, rowid_first_column_in_result=True, html_top_inject=html_top_inject, sorting=sorting, projection=projection)
+
+        if not q.startswith('%'):
+            q = '%' + q
+        if not q.endswith('%'):
+            q = q + '%'
+        paging = paging_from_request(get_dict, table_name, where_sql='%s like ?' % qualified_column(table_name, quick_search_column_name), where_bind_parameters=(q, ), url_parameters=url_parameters, sorting=sorting, projection=projection)
+        return table_rows(environ, start_response, dal, table_name=table_name, schema=schema, html_top_inject=html_top_inject, paging=paging, sorting=sorting, projection=projection)
 
     if len(path_info_list) == 4:
         if path_info_list[3] == 'rows':
-            return table_rows(environ, start_response, dal, table_name, schema)
+            # http://localhost:8777/d/memory/kitchen_sink/rows/?after=ROWID&limit=N
+            # http://localhost:8777/d/memory/kitchen_sink/rows/?sort=COLUMN&dir=desc&after=ROWID&after_key=JSON_VALUE
+            environ['sqlshite.route'] = 'rows'
+            start_response, response = conditional_get(environ, start_response, dal, 'rows', table_name, environ.get('QUERY_STRING', ''))
+            if response is not None:
+                return response
+            url_parameters = list_url_parameters(get_dict)
+            sorting = sorting_from_request(get_dict, schema, url_parameters=url_parameters)
+            projection = projection_from_request(get_dict, dal, table_name, schema, sorting=sorting)
+            paging = paging_from_request(get_dict, table_name, url_parameters=url_parameters, sorting=sorting, projection=projection)
+            return table_rows(environ, start_response, dal, table_name, schema, paging=paging, sorting=sorting, projection=projection)
         elif path_info_list[3] == 'add':
+            environ['sqlshite.route'] = 'add'
             return add_row(environ, start_response, dal, table_name, schema, request_body=request_body)
+        elif path_info_list[3] in ('rows.csv', 'rows.ndjson'):
+            # http://localhost:8777/d/memory/kitchen_sink/rows.csv?cols=number,str
+            environ['sqlshite.route'] = 'export'
+            column_names = projection_from_request(get_dict, dal, table_name, schema)['columns']
+            sql = 'select %s from %s order by rowid' % (', '.join(sqlshite.quote_identifier(x) for x in column_names), sqlshite.quote_identifier(table_name))
+            export_format = path_info_list[3].split('.', 1)[1]
+            return export_rows(environ, start_response, dal, export_format, sql, filename=table_name + '.' + export_format)
+        elif path_info_list[3] == 'import':
+            # POST http://localhost:8777/d/memory/kitchen_sink/import?format=csv&batch_size=N
+            environ['sqlshite.route'] = 'import'
+            return import_rows(environ, start_response, dal, table_name)
+        elif path_info_list[3] == 'rows.json':
+            # POST http://localhost:8777/d/memory/kitchen_sink/rows.json  [{"str": "new row"}, {"rowid": 1, "str": "update"}]
+            environ['sqlshite.route'] = 'rows_json'
+            return bulk_rows_json(environ, start_response, dal, table_name, schema, request_body=request_body)
         else:
             operation = path_info_list[3]
             try:
                 # Assume SQLite3
                 rowid = int(operation)
+                environ['sqlshite.route'] = 'view_json'
+                start_response, response = conditional_get(environ, start_response, dal, 'view_json', table_name, rowid)
+                if response is not None:
+                    return response
                 return view_row(environ, start_response, dal, table_name, schema, rowid)
             except ValueError:
                 pass  # just view table
@@ -843,63 +2323,246 @@ def table_explore(environ, start_response, path_info=None, path_info_list=None,
                 # http://localhost:8777/d/memory/kitchen_sink/view/1/
                 operation = path_info_list[4]
                 rowid = int(operation)
+                environ['sqlshite.route'] = 'view'
                 return view_html(environ, start_response, dal, table_name, schema, rowid, request_body=request_body)
             elif path_info.endswith('/view.json'):  # TODO edit
                 # http://localhost:8777/d/memory/kitchen_sink/1/view.json  # unused yet...
                 # Assume SQLite3
                 operation = path_info_list[3]
                 rowid = int(operation)
+                environ['sqlshite.route'] = 'view_json'
+                start_response, response = conditional_get(environ, start_response, dal, 'view_json', table_name, rowid)
+                if response is not None:
+                    return response
                 return view_row(environ, start_response, dal, table_name, schema, rowid)  # FIXME remove buttons
         except ValueError:
             pass  # just view table
     elif len(path_info_list) == 6:
         try:
-            if path_info.endswith('/view.json'):  # TODO edit
+            if path_info_list[3] == 'value':
+                # http://localhost:8777/d/memory/kitchen_sink/value/1/COLUMN_NAME
+                rowid = int(path_info_list[4])
+                environ['sqlshite.route'] = 'value'
+                return column_value(environ, start_response, dal, table_name, schema, rowid, path_info_list[5])
+            elif path_info_list[3] == 'blob':
+                # http://localhost:8777/d/memory/kitchen_sink/blob/1/COLUMN_NAME
+                rowid = int(path_info_list[4])
+                environ['sqlshite.route'] = 'blob'
+                return blob_value(environ, start_response, dal, table_name, schema, rowid, path_info_list[5])
+            elif path_info.endswith('/view.json'):  # TODO edit
                 # http://localhost:8777/d/memory/kitchen_sink/view/1/view.json
                 operation = path_info_list[4]
                 rowid = int(operation)
+                environ['sqlshite.route'] = 'view_json'
+                start_response, response = conditional_get(environ, start_response, dal, 'view_json', table_name, rowid)
+                if response is not None:
+                    return response
                 return view_row(environ, start_response, dal, table_name, schema, rowid)
         except ValueError:
             pass  # just view table
 
-    result.append(render_template('table_explorer.html', {'table_name': table_name}))
+    environ['sqlshite.route'] = 'table'
+    result.append(render_template('table_explorer.html', {'table_name': table_name, 'prefix_mode': dal.table_setting(table_name, 'quick_search_mode') == 'prefix'}))
     start_response(status, headers)
     return result
 
+def write_not_supported(data):
+    raise NotImplementedError('start_response() write callable not supported')
+
+class CompressionMiddleware:
+    """WSGI middleware, gzip compress responses (html, json, etc.) when the client accepts gzip.
+    Works with both buffered (list) and streamed (generator) responses. The first min_size bytes
+    are buffered to decide if worth compressing, after that each chunk is compressed and flushed
+    (Z_SYNC_FLUSH) so streamed pages still arrive incrementally.
+    Responses that are already encoded (e.g. pre-compressed static files) are left as-is.
+    """
+    compressible_content_types = ('text/', 'application/json', 'application/javascript', 'application/xml')
+
+    def __init__(self, app, level=6, min_size=1024):
+        self.app = app
+        self.level = level
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] == 'HEAD' or not accepts_gzip(environ):
+            return self.app(environ, start_response)
+        response = {}
+        def capture_start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            response['exc_info'] = exc_info
+            return write_not_supported
+        result = self.app(environ, capture_start_response)
+        return self.compress_iter(result, response, start_response)
+
+    def is_compressible(self, status, headers):
+        if not status.startswith('200'):
+            return False
+        content_type = None
+        for header_name, header_value in headers:
+            header_name = header_name.lower()
+            if header_name == 'content-encoding':
+                return False
+            elif header_name == 'content-type':
+                content_type = header_value.lower()
+        return content_type is not None and content_type.startswith(self.compressible_content_types)
+
+    def send_headers(self, response, start_response, compress):
+        """Call (real) start_response, returns compressor if response is to be compressed, else None
+        """
+        status, headers = response['status'], response['headers']
+        compressor = None
+        if compress and self.is_compressible(status, headers):
+            new_headers = []
+            for header_name, header_value in headers:
+                header_name_lower = header_name.lower()
+                if header_name_lower == 'content-length':
+                    continue
+                elif header_name_lower == 'etag' and not header_value.startswith('W/'):
+                    header_value = 'W/' + header_value  # different bytes, only weakly equal
+                new_headers.append((header_name, header_value))
+            new_headers.append(('Content-Encoding', 'gzip'))
+            new_headers.append(('Vary', 'Accept-Encoding'))
+            headers = new_headers
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+        start_response(status, headers, response.get('exc_info'))
+        return compressor
+
+    def compress_iter(self, result, response, start_response):
+        try:
+            pending = []
+            pending_size = 0
+            started = False
+            compressor = None
+            for chunk in result:
+                if not started:
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    if pending_size < self.min_size:
+                        continue
+                    compressor = self.send_headers(response, start_response, compress=True)
+                    started = True
+                    chunk = b''.join(pending)
+                    pending = None
+                if compressor:
+                    chunk = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if chunk:
+                    yield chunk
+            if not started:
+                # small (or empty) response, not worth compressing
+                self.send_headers(response, start_response, compress=False)
+                yield b''.join(pending)
+            elif compressor:
+                yield compressor.flush()
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+def make_app():
+    """Returns WSGI application, with optional compression based on config
+    """
+    app = DalWebApp()
+    if global_config.get('compress'):
+        app = CompressionMiddleware(app, level=global_config.get('compress_level', 6), min_size=global_config.get('compress_min_size', 1024))
+    return app
+
 # WSGI application class
+def profile_requested(environ):
+    """Returns None (no profiling), 'cpu', or 'memory' (cpu and tracemalloc) from
+    X-Profile header or _profile query parameter. Only if profile config enabled.
+    """
+    if not global_profiler.enabled:
+        return None
+    value = environ.get('HTTP_X_PROFILE')
+    if not value and '_profile=' in environ.get('QUERY_STRING', ''):
+        value = get_first_value(parse_qs(environ['QUERY_STRING']), '_profile')
+    if not value or value in ('0', 'false'):
+        return None
+    if value == 'memory' or global_config.get('profile_memory', False):
+        return 'memory'
+    return 'cpu'
+
+def profile_results(environ, start_response, path_info_list):
+    """/_profile/ lists recent profiles, /_profile/ID shows pstats (and tracemalloc) report
+    """
+    if not global_profiler.enabled:
+        return not_found_404(environ, start_response)
+    if len(path_info_list) == 1:
+        body = global_profiler.index_text()
+    else:
+        request_profile = global_profiler.get(path_info_list[1])
+        if request_profile is None:
+            return not_found_404(environ, start_response)
+        sort_by = get_first_value(parse_qs(environ.get('QUERY_STRING', '')), 'sort') or 'cumulative'
+        if sort_by not in ('cumulative', 'tottime', 'calls', 'ncalls', 'filename', 'name'):
+            sort_by = 'cumulative'
+        body = request_profile.report(sort_by=sort_by)
+    body = to_bytes(body)
+    start_response('200 OK', [('Content-Type', 'text/plain; charset=utf-8'), ('Content-Length', str(len(body))), ('Cache-Control', 'no-cache')])
+    return [body]
+
 class DalWebApp:
     def __call__(self, environ, start_response):
+        request_profile = None
+        profile_mode = profile_requested(environ)
+        if profile_mode:
+            description = '%s %s?%s' % (environ['REQUEST_METHOD'], environ['PATH_INFO'], environ.get('QUERY_STRING', ''))
+            request_profile = global_profiler.start(description, memory=profile_mode == 'memory')
+            if request_profile is None:
+                log.warning('profile already in progress, not profiling %s', description)
+            else:
+                profile_start_response = start_response
+                def start_response(status, headers, exc_info=None):
+                    headers = list(headers) + [('X-Profile-Id', request_profile.profile_id)]
+                    return profile_start_response(status, headers, exc_info)
+        metrics_info = None
+        if global_metrics.enabled:
+            metrics_info = {'environ': environ, 'start_time': timer(), 'status': None}
+            global_metrics.request_start()
+            real_start_response = start_response
+            def start_response(status, headers, exc_info=None):
+                metrics_info['status'] = status
+                return real_start_response(status, headers, exc_info)
+        try:
+            result = self.handle_request(environ, start_response)
+        except:
+            release_database_connections()
+            if request_profile is not None:
+                global_profiler.stop(request_profile)
+            if metrics_info is not None:
+                global_metrics.request_end(environ.get('sqlshite.route', 'other'), '500', timer() - metrics_info['start_time'], 0)
+            raise
+        return ReleaseConnectionsIterable(result, metrics_info, request_profile)
+
+    def handle_request(self, environ, start_response):
         status = '200 OK'
         headers = [('Content-type', 'text/plain')]
         result= []
 
+        debug = global_config.get('debug', False)
         path_info = environ['PATH_INFO']
         path_info_list = [x for x in path_info.split('/') if x]
-        print('DalWebApp: path_info %r' % path_info)
-        print('DalWebApp: path_info_list %r' % path_info_list)
+        if debug:
+            print('DalWebApp: path_info %r' % path_info)
+            print('DalWebApp: path_info_list %r' % path_info_list)
 
         if path_info == '/':
             path_info = '/index.html'
-        # see if there is a flat file on the filesystem
-        if path_info and path_info.startswith('/'): # assuming ALWAYS_RETURN_404=false (or at least not true)
-            filename = os.path.join(host_dir, path_info[1:])
-            filename = os.path.abspath(filename)  # trim of trailing slashes, and handle relative paths ./ and ../
-            print('check if we have %r file locally to serve' % filename)
-        if os.path.exists(filename):
-            content_type, result = serve_file(filename)
-            print(content_type)
-            if result:
-                if content_type:
-                    headers = [('Content-type', content_type)]
-                if 1:
-                    headers.append(('Content-Length', str(len(result[0]))))
-                    #headers.append(('Last-Modified', 'Sun, 01 Jan 2023 18:53:39 GMT'))  # this is the format expected
-                    headers.append(('Last-Modified', current_timestamp_for_header()))  # many clients will cache
-                    # TODO 'Date'? bjoern does NOT include this by default where as wsgiref does
-
-            print('serving static file %r' % path_info)
-            start_response(status, headers)
-            return result
+        # see if there is a flat file (loaded from the filesystem at startup)
+        static_file = static_files.lookup(path_info)
+        if static_file:
+            # TODO 'Date'? bjoern does NOT include this by default where as wsgiref does
+            environ['sqlshite.route'] = 'static'
+            if debug:
+                print('serving static file %r' % path_info)
+            return static_files.serve(environ, start_response, static_file)
+
+        if path_info == '/metrics':
+            environ['sqlshite.route'] = 'metrics'
+            return metrics(environ, start_response)
+        if path_info_list and path_info_list[0] == '_profile':
+            environ['sqlshite.route'] = 'profile'
+            return profile_results(environ, start_response, path_info_list)
 
         # Returns a dictionary in which the values are lists
         if environ.get('QUERY_STRING'):
@@ -908,20 +2571,21 @@ class DalWebApp:
             get_dict = {}  # wonder if should make None to make clear its not there at all
 
         # dump out information about request
-        #print(environ)
-        #pprint(environ)
-        print('PATH_INFO %r' % environ['PATH_INFO'])
-        print('PATH_INFO split %r' % environ['PATH_INFO'].split('/'))
-        print('PATH_INFO split2%r' % path_info_list)
-        print('CONTENT_TYPE %r' % environ.get('CONTENT_TYPE'))  # missing under bjoern
-        print('QUERY_STRING %r' % environ.get('QUERY_STRING'))  # missing under bjoern
-        print('QUERY_STRING dict %r' % get_dict)
-        print('REQUEST_METHOD %r' % environ['REQUEST_METHOD'])
-        print('Filtered headers, HTTP*')
-        for key in environ:
-            if key.startswith('HTTP_'):  # TODO potentially startswith 'wsgi' as well
-                # TODO remove leading 'HTTP_'?
-                print('http header ' + key + ' = ' + repr(environ[key]))
+        if debug:
+            #print(environ)
+            #pprint(environ)
+            print('PATH_INFO %r' % environ['PATH_INFO'])
+            print('PATH_INFO split %r' % environ['PATH_INFO'].split('/'))
+            print('PATH_INFO split2%r' % path_info_list)
+            print('CONTENT_TYPE %r' % environ.get('CONTENT_TYPE'))  # missing under bjoern
+            print('QUERY_STRING %r' % environ.get('QUERY_STRING'))  # missing under bjoern
+            print('QUERY_STRING dict %r' % get_dict)
+            print('REQUEST_METHOD %r' % environ['REQUEST_METHOD'])
+            print('Filtered headers, HTTP*')
+            for key in environ:
+                if key.startswith('HTTP_'):  # TODO potentially startswith 'wsgi' as well
+                    # TODO remove leading 'HTTP_'?
+                    print('http header ' + key + ' = ' + repr(environ[key]))
 
         # TODO if not GET
         # POST values
@@ -932,22 +2596,26 @@ class DalWebApp:
             request_body_size = 0
         request_body = None
 
-        read_body_payload = True
+        read_body_payload = not is_import_path(path_info_list)  # import streams wsgi.input itself
         if environ['REQUEST_METHOD'] != 'GET' and read_body_payload:
             # Read POST, etc. body
             if request_body_size:
-                print('read with size %r' % request_body_size)
+                if debug:
+                    print('read with size %r' % request_body_size)
                 request_body = environ['wsgi.input'].read(request_body_size)
             else:
-                print('read with NO size')
+                if debug:
+                    print('read with NO size')
                 #import pdb ; pdb.set_trace()
                 request_body = environ['wsgi.input'].read()  # everything, seen on linux where zero param would return no bytes
-                print('read with NO size completed')
+                if debug:
+                    print('read with NO size completed')
 
         #if path_info and path_info.startswith('/'):
 
-        print('body payload: %r' % request_body)  # e.g. from a form POST (looks like GET key/values)
-        if environ.get('CONTENT_TYPE') == 'application/json' and json and request_body:
+        if debug:
+            print('body payload: %r' % request_body)  # e.g. from a form POST (looks like GET key/values)
+        if debug and environ.get('CONTENT_TYPE') == 'application/json' and json and request_body:
             # 1. Validate the payload - with stacktrace on failure
             # 2. Pretty Print/display the payload
             print('POST json body\n-------------\n%s\n-------------\n' % json.dumps(json.loads(request_body), indent=4))
@@ -955,8 +2623,10 @@ class DalWebApp:
 
         if path_info == '/d' or path_info.startswith('/d/'):
             if len(path_info_list) == 1:
+                environ['sqlshite.route'] = 'list_databases'
                 return list_databases(environ, start_response)
             elif len(path_info_list) == 2:
+                environ['sqlshite.route'] = 'list_tables'
                 return list_tables(environ, start_response)
             elif len(path_info_list) in (3, 4, 5, 6):
                 return table_explore(environ, start_response, path_info=path_info, path_info_list=path_info_list, request_body=request_body)
@@ -964,6 +2634,7 @@ class DalWebApp:
 
         if True:
             # Disable this to send 200 and empty body
+            environ['sqlshite.route'] = 'not_found'
             return not_found_404(environ, start_response)
 
         start_response(status, headers)
@@ -987,7 +2658,6 @@ def main(argv=None):
         f.close()
         config = json.loads(json_bytes)
     else:
-        # FIXME config lookup option quick_search_column_name in config for override
         config = {
             "databases": {
                 "memory": ":memory:",
@@ -998,13 +2668,36 @@ def main(argv=None):
     print(host_dir)
     print(config)
     global_config.update(config)
+    global_metrics.enabled = config.get('metrics', True)
+    global_profiler.enabled = config.get('profile', False)
+    global_profiler.keep = config.get('profile_keep', global_profiler.keep)
+    if not config.get('debug', False):
+        log.setLevel(level=logging.INFO)  # skip (per request) debug logging
+    template_cache.reload = config.get('template_reload', False)
+    template_cache.warm()
+    static_files.reload = config.get('static_reload', False)
+    static_files.load_all()
     for database_name in config["databases"]:
-        connection_string = config["databases"][database_name]
-        db = sqlshite.DatabaseWrapper(connection_string)
+        # either a connection string or a dictionary of per database settings
+        database_config = config["databases"][database_name]
+        if not isinstance(database_config, dict):
+            database_config = {"connection_string": database_config}
+        connection_string = database_config["connection_string"]
+        db = sqlshite.DatabaseWrapper(
+            connection_string,
+            pool_size=database_config.get('pool_size', config.get('pool_size')),
+            check_same_thread=database_config.get('check_same_thread', config.get('check_same_thread')),
+        )
         db.do_connect()
-        dal = sqlshite.DataAccessLayer(db, name=database_name)
+        dal = sqlshite.DataAccessLayer(db, name=database_name, config=database_config)
+        db.release()  # schema scan done, return connection to pool
+        if dal_setting(dal, 'write_queue', False):
+            db.start_write_queue(
+                max_batch=dal_setting(dal, 'group_commit_size', sqlshite.DEFAULT_GROUP_COMMIT_SIZE),
+                max_delay=dal_setting(dal, 'group_commit_delay_ms', sqlshite.DEFAULT_GROUP_COMMIT_DELAY * 1000) / 1000.0,
+            )
         global_dbs[database_name] = dal
-    my_start_server(DalWebApp)
+    my_start_server(make_app)
 
     return 0
 
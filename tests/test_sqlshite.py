@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+"""Tests for sqlshite (DatabaseWrapper, WriteQueue)
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import sqlshite
+
+
+class TestConverters(unittest.TestCase):
+    def test_bool_converter(self):
+        # Python 3 sqlite3 passes converters bytes
+        self.assertEqual(sqlshite.bool_converter(b'0'), False)
+        self.assertEqual(sqlshite.bool_converter(b'1'), True)
+        self.assertEqual(sqlshite.bool_converter('false'), False)
+
+    def test_bool_column(self):
+        connection = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+        connection.execute('CREATE TABLE t (yes_no BOOLEAN)')
+        connection.executemany('INSERT INTO t VALUES (?)', [(0,), (1,)])
+        self.assertEqual(connection.execute('SELECT yes_no FROM t ORDER BY rowid').fetchall(), [(False,), (True,)])
+        connection.close()
+
+
+class TestWriteQueue(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.database_filename = os.path.join(self.temp_dir, 'test.db')
+        connection = sqlite3.connect(self.database_filename)
+        connection.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)')
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_write(self):
+        db = sqlshite.DatabaseWrapper(self.database_filename)
+        db.do_connect()
+        db.start_write_queue()
+        try:
+            rowid = db.write(lambda connection: connection.execute("INSERT INTO t (name) VALUES ('a')").lastrowid)
+        finally:
+            db.do_disconnect()
+        self.assertEqual(rowid, 1)
+        connection = sqlite3.connect(self.database_filename)
+        self.assertEqual(connection.execute('SELECT id, name FROM t').fetchall(), [(1, 'a')])
+        connection.close()
+
+    def test_connect_error(self):
+        def connect_function():
+            raise sqlite3.OperationalError('unable to open database file')
+        write_queue = sqlshite.WriteQueue(connect_function)
+        write_queue.start()
+        self.assertRaises(sqlite3.OperationalError, write_queue.submit, lambda connection: None)
+        write_queue.thread.join(5)
+        self.assertFalse(write_queue.thread.is_alive())
+        self.assertRaises(sqlite3.OperationalError, write_queue.submit, lambda connection: None)
+        write_queue.stop()
+
+
+class TestDataAccessLayerWrites(unittest.TestCase):
+    """Schema changes go through DatabaseWrapper.write(), i.e. the write queue if started"""
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.database_filename = os.path.join(self.temp_dir, 'test.db')
+        connection = sqlite3.connect(self.database_filename)
+        connection.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)')
+        connection.commit()
+        connection.close()
+        self.db = sqlshite.DatabaseWrapper(self.database_filename)
+        self.db.do_connect()
+        self.db.start_write_queue()
+
+    def tearDown(self):
+        self.db.do_disconnect()
+        shutil.rmtree(self.temp_dir)
+
+    def sqlite_master_names(self):
+        connection = sqlite3.connect(self.database_filename)
+        try:
+            return [x[0] for x in connection.execute('SELECT name FROM sqlite_master')]
+        finally:
+            connection.close()
+
+    def test_create_index(self):
+        dal = sqlshite.DataAccessLayer(self.db, name='test', config={})
+        self.db.cursor.execute('SELECT * FROM t')  # reader connection is in use
+        name = dal.create_index('t', 'name')
+        self.assertTrue(name in self.sqlite_master_names())
+
+    def test_setup_fts(self):
+        dal = sqlshite.DataAccessLayer(self.db, name='test', config={'tables': {'t': {'fts': True}}})
+        if 't' not in dal.fts:
+            self.skipTest('FTS5 (trigram) not available in this SQLite build')
+        self.assertTrue(sqlshite.fts_table_name('t') in self.sqlite_master_names())
+
+
+if __name__ == '__main__':
+    unittest.main()
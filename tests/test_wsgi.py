@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: us-ascii -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+#
+"""Tests for sqlshite.web.wsgi, requests are made in-process against DalWebApp
+
+    python -m unittest discover -s tests
+"""
+
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import sqlshite
+from sqlshite.web import wsgi
+
+
+class WsgiTestCase(unittest.TestCase):
+    create_sql = None  # list of SQL statements run against a new database before each test
+    database_config = {}
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.database_filename = os.path.join(self.temp_dir, 'test.db')
+        connection = sqlite3.connect(self.database_filename)
+        for sql in self.create_sql or []:
+            connection.execute(sql)
+        connection.commit()
+        connection.close()
+        config = dict(self.database_config, connection_string=self.database_filename)
+        wsgi.global_config.clear()
+        wsgi.global_config.update({'databases': {'test': config}})
+        wsgi.global_dbs.clear()
+        db = sqlshite.DatabaseWrapper(self.database_filename)
+        db.do_connect()
+        wsgi.global_dbs['test'] = sqlshite.DataAccessLayer(db, name='test', config=config)
+        self.app = wsgi.DalWebApp()
+
+    def tearDown(self):
+        for dal in wsgi.global_dbs.values():
+            dal.db.do_disconnect()
+        wsgi.global_dbs.clear()
+        wsgi.global_config.clear()
+        shutil.rmtree(self.temp_dir)
+
+    def request(self, path, query_string='', method='GET', body=b'', content_type=None):
+        """Returns (status, headers dict, body bytes)"""
+        environ = {
+            'PATH_INFO': path,
+            'QUERY_STRING': query_string,
+            'REQUEST_METHOD': method,
+            'wsgi.input': io.BytesIO(body),
+            'CONTENT_LENGTH': str(len(body)),
+        }
+        if content_type:
+            environ['CONTENT_TYPE'] = content_type
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        result = self.app(environ, start_response)
+        try:
+            body = b''.join(x if isinstance(x, bytes) else x.encode('utf-8') for x in result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], body
+
+    def query(self, sql, bind_parameters=()):
+        connection = sqlite3.connect(self.database_filename)
+        try:
+            return connection.execute(sql, bind_parameters).fetchall()
+        finally:
+            connection.close()
+
+
+class TestEditForm(WsgiTestCase):
+    create_sql = [
+        'CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT, yes_no BOOLEAN, qty INTEGER)',
+        "INSERT INTO t (id, name, yes_no, qty) VALUES (1, 'a', 1, 5)",
+    ]
+
+    def post_form(self, path, body):
+        return self.request(path, method='POST', body=body, content_type='application/x-www-form-urlencoded')
+
+    def test_uncheck_bool(self):
+        # unchecked checkbox is not in the POST at all
+        status, headers, body = self.post_form('/d/test/t/view/1/', b'id=1&name=a&qty=5')
+        self.assertEqual(status, '302 Found')
+        self.assertEqual(self.query('SELECT yes_no FROM t WHERE id = 1'), [(0,)])
+        status, headers, body = self.request('/d/test/t/view/1/view.json')
+        self.assertEqual(json.loads(body.decode('utf-8'))['value']['yes_no'], False)
+
+    def test_check_bool(self):
+        self.post_form('/d/test/t/view/1/', b'id=1&name=a&qty=5')
+        status, headers, body = self.post_form('/d/test/t/view/1/', b'id=1&name=a&yes_no=1&qty=5')
+        self.assertEqual(status, '302 Found')
+        self.assertEqual(self.query('SELECT yes_no FROM t WHERE id = 1'), [(1,)])
+
+    def test_clear_field(self):
+        status, headers, body = self.post_form('/d/test/t/view/1/', b'id=1&name=a&yes_no=1&qty=')
+        self.assertEqual(status, '302 Found')
+        self.assertEqual(self.query('SELECT name, qty FROM t WHERE id = 1'), [('a', None)])
+
+
+class TestConditionalGet(WsgiTestCase):
+    create_sql = [
+        'CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)',
+        "INSERT INTO t (name) VALUES ('a')",
+        "INSERT INTO t (name) VALUES ('b')",
+    ]
+
+    def test_rows_etag_depends_on_query_string(self):
+        etags = set()
+        for query_string in ('', 'limit=1', 'sort=name&dir=desc'):
+            status, headers, body = self.request('/d/test/t/rows/', query_string)
+            self.assertEqual(status, '200 OK')
+            etags.add(headers['ETag'])
+        self.assertEqual(len(etags), 3)
+
+    def test_view_json_etags(self):
+        for path in ('/d/test/t/1/', '/d/test/t/1/view.json', '/d/test/t/view/1/view.json'):
+            status, headers, body = self.request(path)
+            self.assertEqual(status, '200 OK')
+            self.assertTrue('ETag' in headers, path)
+
+
+class TestResultCache(WsgiTestCase):
+    create_sql = [
+        'CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT, qty INTEGER)',
+        "INSERT INTO t (name, qty) VALUES ('a', 1)",
+    ]
+
+    def setUp(self):
+        WsgiTestCase.setUp(self)
+        wsgi.global_result_caches.clear()
+
+    def test_cols_in_key(self):
+        status, headers, body = self.request('/d/test/t/rows/', 'cols=name,qty')
+        status, headers, body_spaced = self.request('/d/test/t/rows/', 'cols=name,+qty')  # same columns, different links
+        self.assertTrue(b'cols=name%2C+qty' in body_spaced)
+        self.assertEqual(len(wsgi.global_result_caches['test'].entries), 2)
+
+    def test_too_big_not_cached(self):
+        result_cache = wsgi.get_result_cache(wsgi.global_dbs['test'])
+        result_cache.max_bytes = 10
+        status, headers, body = self.request('/d/test/t/rows/')
+        self.assertEqual(status, '200 OK')
+        self.assertTrue(len(body) > 10)
+        self.assertEqual(len(result_cache.entries), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()